@@ -0,0 +1,1412 @@
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.optimize import minimize
+from scipy.signal import lfilter
+from scipy.stats import norm
+
+# =============================================================================
+# TECHNICAL INDICATORS
+# =============================================================================
+
+# Indicator parameters used by the Stock Analysis tab
+DEFAULT_INDICATOR_PARAMS = {
+    'ma': (20, 50),
+    'rsi': 14,
+    'macd': (12, 26, 9),
+    'bollinger': (20, 2.0),
+    'atr': 14,
+    'obv': True,
+}
+
+# Trailing bars that may still be revised upstream (the live session and the overlap
+# bar the OHLCV store re-fetches), so resumable state is only saved before them
+UNSETTLED_BARS = 2
+
+
+def _window_means(buffer, window):
+    csum = np.concatenate(([0.0], np.cumsum(buffer)))
+    return (csum[window:] - csum[:-window]) / window
+
+
+def _window_stds(buffer, window):
+    return sliding_window_view(buffer, window).std(axis=1, ddof=1)
+
+
+def _rolling_extend(values, window, tail, reducer):
+    """Apply reducer to every full window of tail + values.
+
+    Returns the outputs for values (NaN until the window is full) and the
+    last window - 1 inputs, which is all the state a rolling window needs.
+    """
+    buffer = values if tail is None else np.concatenate((tail, values))
+    carried = len(buffer) - len(values)
+    out = np.full(len(values), np.nan)
+    if len(buffer) >= window:
+        reduced = reducer(buffer, window)
+        first = window - 1 - carried
+        out[max(first, 0):] = reduced[max(-first, 0):]
+    return out, buffer[max(len(buffer) - (window - 1), 0):]
+
+
+def _ewm_extend(values, span, state):
+    """Adjusted EWM of values continuing from state = (weighted sum, weight total)"""
+    decay = 1 - 2 / (span + 1)
+    if len(values) == 0:
+        return np.array([]), state
+    numerator_0, denominator_0 = state if state is not None else (0.0, 0.0)
+    # pandas' adjusted EWM divides the decayed sum of values by the decayed sum of weights
+    numerator = lfilter([1.0], [1.0, -decay], values, zi=[decay * numerator_0])[0]
+    denominator = lfilter([1.0], [1.0, -decay], np.ones(len(values)), zi=[decay * denominator_0])[0]
+    return numerator / denominator, (numerator[-1], denominator[-1])
+
+
+def _wilder_extend(values, window, previous):
+    """Wilder smoothing of values continuing from the previous smoothed value"""
+    alpha = 1 / window
+    out = np.empty(len(values))
+    if len(values) == 0:
+        return out, previous
+    start = 0
+    if previous is None:
+        out[0] = previous = values[0]
+        start = 1
+    out[start:] = lfilter([alpha], [1.0, alpha - 1], values[start:], zi=[(1 - alpha) * previous])[0]
+    return out, out[-1]
+
+
+def rolling_mean(values, window):
+    """Simple moving average, NaN until the window is full"""
+    return _rolling_extend(np.asarray(values, dtype=float), window, None, _window_means)[0]
+
+
+def rolling_std(values, window):
+    """Rolling sample standard deviation, NaN until the window is full"""
+    return _rolling_extend(np.asarray(values, dtype=float), window, None, _window_stds)[0]
+
+
+def ewm_mean(values, span):
+    """Exponentially weighted mean, same as pandas ewm(span=span).mean()"""
+    return _ewm_extend(np.asarray(values, dtype=float), span, None)[0]
+
+
+def wilder_mean(values, window):
+    """Wilder smoothing, same as pandas ewm(alpha=1/window, adjust=False).mean()"""
+    return _wilder_extend(np.asarray(values, dtype=float), window, None)[0]
+
+
+def rsi(close, window=14):
+    """Relative Strength Index from simple averages of gains and losses"""
+    return compute_indicators(None, None, None, close, None, {'rsi': window})['RSI']
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    """MACD line, signal line and histogram"""
+    results = compute_indicators(None, None, None, close, None, {'macd': (fast, slow, signal)})
+    return results['MACD'], results['MACD_signal'], results['MACD_histogram']
+
+
+def bollinger_bands(close, window=20, num_std=2.0):
+    """Middle, upper and lower Bollinger Bands"""
+    results = compute_indicators(None, None, None, close, None, {'bollinger': (window, num_std)})
+    return results['BB_middle'], results['BB_upper'], results['BB_lower']
+
+
+def average_true_range(high, low, close, window=14):
+    """Average True Range with Wilder smoothing"""
+    return compute_indicators(None, high, low, close, None, {'atr': window})['ATR']
+
+
+def on_balance_volume(close, volume):
+    """On-Balance Volume, starting from zero on the first bar"""
+    return compute_indicators(None, None, None, close, volume, {'obv': True})['OBV']
+
+
+def extend_indicators(state, open_, high, low, close, volume, params=DEFAULT_INDICATOR_PARAMS):
+    """Compute every indicator in params for newly appended bars.
+
+    state is what a previous call returned (None for the first bars of a series):
+    the EWM accumulators, Wilder averages, rolling-window tails and the previous
+    close. The work done is proportional to the number of new bars, not to the
+    length of the history. Returns (results for the new bars, new state); the
+    state passed in is left untouched.
+    """
+    state = dict(state or {})
+    close = np.asarray(close, dtype=float)
+    results = {}
+
+    previous_close = state.get('close', np.nan)
+    delta = np.diff(close, prepend=previous_close)
+    if len(close):
+        state['close'] = close[-1]
+
+    for window in params.get('ma', ()):
+        results[f'MA{window}'], state[('ma', window)] = _rolling_extend(
+            close, window, state.get(('ma', window)), _window_means
+        )
+
+    if params.get('rsi'):
+        window = params['rsi']
+        gain = np.where(delta > 0, delta, 0.0)
+        loss = np.where(delta < 0, -delta, 0.0)
+        average_gain, state['rsi_gain'] = _rolling_extend(gain, window, state.get('rsi_gain'), _window_means)
+        average_loss, state['rsi_loss'] = _rolling_extend(loss, window, state.get('rsi_loss'), _window_means)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            results['RSI'] = 100 - (100 / (1 + average_gain / average_loss))
+
+    if params.get('macd'):
+        fast, slow, signal = params['macd']
+        fast_ewm, state['macd_fast'] = _ewm_extend(close, fast, state.get('macd_fast'))
+        slow_ewm, state['macd_slow'] = _ewm_extend(close, slow, state.get('macd_slow'))
+        macd_line = fast_ewm - slow_ewm
+        signal_line, state['macd_signal'] = _ewm_extend(macd_line, signal, state.get('macd_signal'))
+        results['MACD'], results['MACD_signal'] = macd_line, signal_line
+        results['MACD_histogram'] = macd_line - signal_line
+
+    if params.get('bollinger'):
+        window, num_std = params['bollinger']
+        middle, state['bb_mean'] = _rolling_extend(close, window, state.get('bb_mean'), _window_means)
+        std, state['bb_std'] = _rolling_extend(close, window, state.get('bb_std'), _window_stds)
+        results['BB_middle'] = middle
+        results['BB_upper'] = middle + num_std * std
+        results['BB_lower'] = middle - num_std * std
+
+    if params.get('atr'):
+        high = np.asarray(high, dtype=float)
+        low = np.asarray(low, dtype=float)
+        previous_closes = np.concatenate(([previous_close], close[:-1]))
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - previous_closes), np.abs(low - previous_closes)))
+        results['ATR'], state['atr'] = _wilder_extend(true_range, params['atr'], state.get('atr'))
+
+    if params.get('obv'):
+        direction = np.sign(np.nan_to_num(delta))
+        obv = state.get('obv', 0.0) + np.cumsum(direction * np.asarray(volume, dtype=float))
+        if len(obv):
+            state['obv'] = obv[-1]
+        results['OBV'] = obv
+
+    return results, state
+
+
+def compute_indicators(open_, high, low, close, volume, params=DEFAULT_INDICATOR_PARAMS):
+    """Compute every indicator in params over the OHLCV arrays in one pass.
+
+    Returns a dict of read-only arrays aligned with the input bars.
+    """
+    results = extend_indicators(None, open_, high, low, close, volume, params)[0]
+    for values in results.values():
+        values.flags.writeable = False
+    return results
+
+
+def params_key(params):
+    """Hashable form of an indicator params dict"""
+    return tuple(sorted(params.items()))
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and, optionally, total size in bytes"""
+
+    def __init__(self, maxsize=64, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        return None
+
+    def put(self, key, value, size=0):
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while len(self._entries) > self.maxsize or (
+                    self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                self.total_bytes -= self._entries.popitem(last=False)[1][1]
+
+
+# Indicators keyed by ticker, first bar and params. Each entry keeps the full result
+# arrays plus the state as of the last settled bar, so a history that grew by N bars
+# is extended in O(N).
+_indicator_cache = LRUCache(maxsize=64)
+
+
+def get_indicators(ticker, hist, params=DEFAULT_INDICATOR_PARAMS):
+    """Return memoized indicators for a yfinance-style history DataFrame.
+
+    Identical bars cost a dict lookup. When the history only gained bars since
+    the last call (or its unsettled tail was revised), indicators are resumed
+    from the saved state instead of recomputed. hist itself is never modified.
+    """
+    if hist is None or hist.empty:
+        return {}
+
+    timestamps = hist.index.asi8
+    closes = hist['Close'].to_numpy(dtype=float)
+    n = len(hist)
+    key = (ticker, int(timestamps[0]), params_key(params))
+    fingerprint = (int(timestamps[-1]), n, closes[-1])
+
+    entry = _indicator_cache.get(key)
+    if entry is not None and entry['fingerprint'] == fingerprint:
+        return entry['results']
+
+    # Resume from the saved state if the bar it was taken at is unchanged
+    start, state, previous = 0, None, {}
+    if entry is not None:
+        settled = entry['settled_length']
+        if 0 < settled <= n and timestamps[settled - 1] == entry['settled_timestamp'] \
+                and closes[settled - 1] == entry['settled_close']:
+            start, state = settled, entry['state']
+            previous = {name: values[:settled] for name, values in entry['results'].items()}
+
+    columns = [hist[name].to_numpy(dtype=float) for name in ('Open', 'High', 'Low', 'Close', 'Volume')]
+    settled = max(start, n - UNSETTLED_BARS)
+    settled_part, settled_state = extend_indicators(state, *(c[start:settled] for c in columns), params)
+    tail_part, _ = extend_indicators(settled_state, *(c[settled:] for c in columns), params)
+
+    results = {}
+    for name in tail_part:
+        parts = [previous[name]] if name in previous else []
+        results[name] = np.concatenate(parts + [settled_part[name], tail_part[name]])
+        results[name].flags.writeable = False
+
+    _indicator_cache.put(key, {
+        'fingerprint': fingerprint,
+        'results': results,
+        'state': settled_state,
+        'settled_length': settled,
+        'settled_timestamp': int(timestamps[settled - 1]) if settled else None,
+        'settled_close': closes[settled - 1] if settled else None,
+    })
+    return results
+
+
+# =============================================================================
+# PERFORMANCE METRICS
+# =============================================================================
+
+TRADING_DAYS = 252
+
+
+def performance_summary(close):
+    """Total and annualized return, annualized volatility and max drawdown of a price series"""
+    close = np.asarray(close, dtype=float)
+    if len(close) < 2:
+        return {'total_return': np.nan, 'annual_return': np.nan, 'volatility': np.nan, 'max_drawdown': np.nan}
+    returns = close[1:] / close[:-1] - 1
+    total_return = close[-1] / close[0] - 1
+    years = len(returns) / TRADING_DAYS
+    return {
+        'total_return': total_return,
+        'annual_return': (1 + total_return) ** (1 / years) - 1,
+        'volatility': returns.std(ddof=1) * np.sqrt(TRADING_DAYS) if len(returns) > 1 else np.nan,
+        'max_drawdown': (close / np.maximum.accumulate(close) - 1).min(),
+    }
+
+
+# =============================================================================
+# RISK METRICS
+# =============================================================================
+
+RISK_WINDOW = 63  # about three months of trading days
+VAR_LEVEL = 0.95
+
+
+def _window_sums(values, window):
+    """Sum of each trailing window along the first axis, NaN until it is full"""
+    csum = np.cumsum(values, axis=0)
+    sums = np.full(values.shape, np.nan)
+    sums[window - 1] = csum[window - 1]
+    sums[window:] = csum[window:] - csum[:-window]
+    return sums
+
+
+def rolling_moments(values, window):
+    """Rolling mean and sample variance along the first axis in one cumulative pass.
+
+    Works on a single series or a (days, tickers) matrix. Values are centered on
+    their overall mean before the running sums are taken, so the sums stay small
+    and the variance doesn't lose precision to cancellation on long histories.
+    """
+    values = np.asarray(values, dtype=float)
+    shift = values.mean(axis=0)
+    centered = values - shift
+    sums = _window_sums(centered, window)
+    squares = _window_sums(centered * centered, window)
+    variance = np.maximum((squares - sums * sums / window) / (window - 1), 0.0)
+    return sums / window + shift, variance
+
+
+def rolling_covariance(x, y, window):
+    """Rolling sample covariance of two aligned series, same approach as rolling_moments"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    dx = x - x.mean(axis=0)
+    dy = y - y.mean(axis=0)
+    sum_x, sum_y = _window_sums(dx, window), _window_sums(dy, window)
+    return (_window_sums(dx * dy, window) - sum_x * sum_y / window) / (window - 1)
+
+
+def rolling_volatility(returns, window=RISK_WINDOW):
+    """Annualized rolling volatility of daily returns"""
+    return np.sqrt(rolling_moments(returns, window)[1] * TRADING_DAYS)
+
+
+def rolling_beta(returns, benchmark, window=RISK_WINDOW):
+    """Rolling beta of returns against aligned benchmark returns"""
+    benchmark = np.asarray(benchmark, dtype=float)
+    if np.ndim(returns) == 2:
+        benchmark = benchmark[:, None]
+    variance = rolling_moments(benchmark, window)[1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return rolling_covariance(returns, benchmark, window) / variance
+
+
+def drawdown_series(close):
+    """Drop from the running peak at every bar, from one running-max pass"""
+    close = np.asarray(close, dtype=float)
+    return close / np.maximum.accumulate(close, axis=0) - 1
+
+
+def value_at_risk(returns, level=VAR_LEVEL):
+    """One-day historical and parametric (normal) VaR and CVaR as positive loss fractions.
+
+    Works along the first axis, so a (days, tickers) matrix gives one value per ticker.
+    """
+    returns = np.asarray(returns, dtype=float)
+    cutoff = np.quantile(returns, 1 - level, axis=0)
+    tail = returns <= cutoff
+    mean = returns.mean(axis=0)
+    std = returns.std(axis=0, ddof=1)
+    z = norm.ppf(1 - level)
+    return {
+        'historical_var': -cutoff,
+        'historical_cvar': -(np.where(tail, returns, 0).sum(axis=0) / tail.sum(axis=0)),
+        'parametric_var': -(mean + z * std),
+        'parametric_cvar': -(mean - std * norm.pdf(z) / (1 - level)),
+    }
+
+
+def sortino_ratio(returns, target=0.0):
+    """Annualized Sortino ratio: excess return over the downside deviation below target"""
+    returns = np.asarray(returns, dtype=float)
+    downside = np.sqrt(np.mean(np.minimum(returns - target, 0.0) ** 2, axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(downside > 0, (returns.mean(axis=0) - target) / downside * np.sqrt(TRADING_DAYS), np.nan)
+
+
+def risk_summary(returns, benchmark_returns=None, window=RISK_WINDOW, level=VAR_LEVEL):
+    """Every risk metric for a series of daily returns, plus rolling series for charting.
+
+    benchmark_returns, when given, must be aligned with returns.
+    """
+    returns = np.asarray(returns, dtype=float)
+    drawdown = drawdown_series(np.concatenate(([1.0], np.cumprod(1 + returns))))
+    summary = {
+        **value_at_risk(returns, level),
+        'max_drawdown': drawdown.min(),
+        'sortino': sortino_ratio(returns),
+        'drawdown': drawdown,
+        'rolling_volatility': rolling_volatility(returns, window) if len(returns) >= window else None,
+        'beta': np.nan,
+        'rolling_beta': None,
+    }
+    if benchmark_returns is not None:
+        benchmark_returns = np.asarray(benchmark_returns, dtype=float)
+        bench = benchmark_returns - benchmark_returns.mean()
+        summary['beta'] = bench @ (returns - returns.mean()) / (bench @ bench)
+        if len(returns) >= window:
+            summary['rolling_beta'] = rolling_beta(returns, benchmark_returns, window)
+    return summary
+
+
+# =============================================================================
+# BACKTESTING
+# =============================================================================
+
+BACKTEST_COST = 0.0005  # 5 basis points charged on every position change
+SWEEP_CHUNK = 512  # parameter sets per worker task
+# Worker processes for sweeps and Monte Carlo: one per core (override with FINLEARN_WORKERS)
+SWEEP_WORKERS = max(1, int(os.environ.get("FINLEARN_WORKERS", 0)) or os.cpu_count() or 1)
+
+
+def ma_crossover_positions(close, fast=20, slow=50):
+    """Long while the fast moving average is above the slow one"""
+    return (rolling_mean(close, fast) > rolling_mean(close, slow)).astype(float)
+
+
+def rsi_positions(close, window=14, lower=30, upper=70):
+    """Buy when RSI drops below lower, sell once it rises above upper"""
+    values = rsi(close, window)
+    return _hold_between(values < lower, values > upper)
+
+
+def macd_positions(close, fast=12, slow=26, signal=9):
+    """Long while the MACD line is above its signal line"""
+    line, signal_line, _ = macd(close, fast, slow, signal)
+    return (line > signal_line).astype(float)
+
+
+def _hold_between(enter, exit_):
+    """Positions that switch on at entry signals and off at exit signals, along the last axis"""
+    events = np.where(enter, 1.0, np.where(exit_, 0.0, np.nan))
+    # Carry the most recent signal forward: index of the last non-NaN event at every bar
+    last = np.where(np.isnan(events), 0, np.arange(events.shape[-1]))
+    np.maximum.accumulate(last, axis=-1, out=last)
+    return np.nan_to_num(np.take_along_axis(events, last, axis=-1))
+
+
+def _held_returns(signals, returns, cost):
+    """Daily strategy returns and trade flags for rows of boolean signals.
+
+    signals[:, t] is decided at close t and traded at close t+1, so it earns the
+    asset's return from t+1 to t+2 and no signal profits from the bar that
+    produced it. Every change of position pays cost.
+    """
+    held = np.zeros_like(signals)
+    held[:, 1:] = signals[:, :-1]
+    trades = np.empty_like(held)
+    trades[:, 0] = held[:, 0]
+    np.not_equal(held[:, 1:], held[:, :-1], out=trades[:, 1:])
+    strategy_returns = held * returns
+    strategy_returns -= trades * cost
+    return strategy_returns, trades
+
+
+def _strategy_stats(signals, returns, cost):
+    """Summary statistics for each row of boolean signals, one matrix pass per statistic"""
+    strategy_returns, trades = _held_returns(signals, returns, cost)
+    n = strategy_returns.shape[1]
+    mean = strategy_returns.sum(axis=1) / n
+    variance = (np.einsum('ij,ij->i', strategy_returns, strategy_returns) - n * mean ** 2) / (n - 1)
+    volatility = np.sqrt(np.maximum(variance, 0.0))
+
+    # The returns matrix is reused in place: first as the equity curve, then as its ratio to the peak
+    equity = strategy_returns
+    equity += 1
+    np.cumprod(equity, axis=1, out=equity)
+    total_return = equity[:, -1] - 1
+    peak = np.maximum.accumulate(equity, axis=1)
+    np.maximum(peak, 1.0, out=peak)
+    np.divide(equity, peak, out=peak)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(volatility > 0, mean / volatility * np.sqrt(TRADING_DAYS), 0.0)
+    return {
+        'total_return': total_return,
+        'annual_return': (1 + total_return) ** (TRADING_DAYS / n) - 1,
+        'volatility': volatility * np.sqrt(TRADING_DAYS),
+        'sharpe': sharpe,
+        'max_drawdown': peak.min(axis=1) - 1,
+        'trades': trades.sum(axis=1),
+    }
+
+
+def run_backtest(close, positions, cost=BACKTEST_COST):
+    """Equity curve, drawdown and summary statistics of holding positions over close"""
+    close = np.asarray(close, dtype=float)
+    positions = np.asarray(positions, dtype=float)
+    returns = close[1:] / close[:-1] - 1
+    signals = positions[None, :-1] > 0
+    strategy_returns, _ = _held_returns(signals, returns, cost)
+    equity = np.concatenate(([1.0], np.cumprod(1 + strategy_returns[0])))
+    stats = {name: values[0].item() for name, values in _strategy_stats(signals, returns, cost).items()}
+    # The last bar's return is earned by the signal from the bar before it
+    stats['exposure'] = float(signals[0, :-1].sum() / len(returns))
+    return {
+        'equity': equity,
+        'drawdown': equity / np.maximum.accumulate(equity) - 1,
+        'positions': positions,
+        **stats,
+    }
+
+
+def _ma_sweep_chunk(close, pairs, cost):
+    """Statistics for every (fast, slow) moving-average pair in one chunk"""
+    returns = close[1:] / close[:-1] - 1
+    pairs = np.asarray(pairs)
+    # Each window's average is computed once and shared by every pair using it
+    means = {window: rolling_mean(close, window)[:-1] for window in np.unique(pairs)}
+    fast = np.stack([means[window] for window in pairs[:, 0]])
+    slow = np.stack([means[window] for window in pairs[:, 1]])
+    return _strategy_stats(fast > slow, returns, cost)
+
+
+def _rsi_sweep_chunk(close, params, cost):
+    """Statistics for every (window, lower, upper) RSI threshold set in one chunk"""
+    returns = close[1:] / close[:-1] - 1
+    params = np.asarray(params)
+    values = {window: rsi(close, int(window))[:-1] for window in np.unique(params[:, 0])}
+    rsi_rows = np.stack([values[window] for window in params[:, 0]])
+    positions = _hold_between(rsi_rows < params[:, 1:2], rsi_rows > params[:, 2:3])
+    return _strategy_stats(positions > 0, returns, cost)
+
+
+SWEEP_KERNELS = {
+    'ma_crossover': (_ma_sweep_chunk, ['fast', 'slow']),
+    'rsi': (_rsi_sweep_chunk, ['window', 'lower', 'upper']),
+}
+
+
+def ma_crossover_grid(min_window=5, max_window=200, step=5):
+    """Every (fast, slow) window pair with fast < slow"""
+    windows = range(min_window, max_window + 1, step)
+    return [(fast, slow) for fast in windows for slow in windows if fast < slow]
+
+
+def rsi_grid(window=14, lowers=range(10, 45, 5), uppers=range(55, 95, 5)):
+    """Every (window, lower, upper) RSI threshold combination"""
+    return [(window, lower, upper) for lower in lowers for upper in uppers]
+
+
+_process_pool = None
+_process_pool_guard = threading.Lock()
+
+
+def get_process_pool():
+    """Process pool shared by CPU-heavy jobs, started on first use"""
+    global _process_pool
+    with _process_pool_guard:
+        if _process_pool is None:
+            # Spawned workers only import this module, forking a threaded server isn't safe
+            _process_pool = ProcessPoolExecutor(
+                max_workers=SWEEP_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+
+def sweep_parameters(strategy, close, grid, cost=BACKTEST_COST):
+    """Backtest every parameter set in grid and return one row of statistics per set.
+
+    The grid is split into chunks that are evaluated as whole matrices; with
+    more than one chunk they run on the shared process pool.
+    """
+    kernel, columns = SWEEP_KERNELS[strategy]
+    close = np.asarray(close, dtype=float)
+    chunks = [grid[i:i + SWEEP_CHUNK] for i in range(0, len(grid), SWEEP_CHUNK)]
+    if len(chunks) <= 1 or SWEEP_WORKERS == 1:
+        results = [kernel(close, chunk, cost) for chunk in chunks]
+    else:
+        results = list(get_process_pool().map(kernel, repeat(close), chunks, repeat(cost)))
+
+    table = pd.DataFrame(grid, columns=columns)
+    for name in results[0] if results else []:
+        table[name] = np.concatenate([result[name] for result in results])
+    return table
+
+
+# =============================================================================
+# PORTFOLIO ANALYTICS
+# =============================================================================
+
+FRONTIER_POINTS = 40
+
+
+def return_matrix(closes):
+    """Daily returns of several close series on the dates they all traded.
+
+    closes maps ticker -> Close Series. Exchanges in different timezones are
+    lined up by calendar date.
+    """
+    aligned = pd.concat(
+        {ticker: pd.Series(close.to_numpy(), index=close.index.tz_localize(None).normalize() if close.index.tz else close.index.normalize())
+         for ticker, close in closes.items()},
+        axis=1, join='inner'
+    )
+    aligned = aligned[~aligned.index.duplicated(keep='last')]
+    return aligned.pct_change().iloc[1:]
+
+
+def portfolio_statistics(returns, weights, benchmark=None, risk_free=0.0):
+    """Annualized return, volatility, Sharpe ratio and beta of a weighted portfolio.
+
+    returns is a (days, assets) array, benchmark an optional array of the
+    benchmark's daily returns on the same days.
+    """
+    returns = np.asarray(returns, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    mean = returns.mean(axis=0) * TRADING_DAYS
+    cov = np.cov(returns, rowvar=False) * TRADING_DAYS
+    annual_return = weights @ mean
+    volatility = np.sqrt(weights @ cov @ weights)
+    stats = {
+        'annual_return': annual_return,
+        'volatility': volatility,
+        'sharpe': (annual_return - risk_free) / volatility if volatility > 0 else np.nan,
+        'beta': np.nan,
+        'asset_betas': np.full(len(weights), np.nan),
+    }
+    if benchmark is not None:
+        benchmark = np.asarray(benchmark, dtype=float)
+        # Every asset's beta in one pass; the portfolio's is their weighted sum
+        centered = returns - returns.mean(axis=0)
+        bench_centered = benchmark - benchmark.mean()
+        asset_betas = bench_centered @ centered / (bench_centered @ bench_centered)
+        stats['asset_betas'] = asset_betas
+        stats['beta'] = weights @ asset_betas
+    return stats
+
+
+def _min_variance_weights(cov, mean=None, target=None, allow_short=False, start=None):
+    """Weights with the lowest variance, optionally at a target expected return"""
+    n = len(cov)
+    constraints = [{'type': 'eq', 'fun': lambda w: w.sum() - 1, 'jac': lambda w: np.ones(n)}]
+    if target is not None:
+        constraints.append({'type': 'eq', 'fun': lambda w: w @ mean - target, 'jac': lambda w: mean})
+    result = minimize(
+        lambda w: w @ cov @ w, np.full(n, 1 / n) if start is None else start,
+        jac=lambda w: 2 * cov @ w, method='SLSQP', constraints=constraints,
+        bounds=None if allow_short else [(0.0, 1.0)] * n,
+        options={'maxiter': 200, 'ftol': 1e-12},
+    )
+    return result.x
+
+
+def efficient_frontier(mean, cov, points=FRONTIER_POINTS, allow_short=False):
+    """Minimum-variance weights for evenly spaced target returns.
+
+    Returns (target returns, volatilities, weights with one row per point). With
+    shorting allowed the frontier has a closed form and every point is solved in
+    one matrix expression; long-only points are solved with SLSQP, each one
+    warm-started from the previous point's weights.
+    """
+    mean = np.asarray(mean, dtype=float)
+    cov = np.asarray(cov, dtype=float)
+    n = len(mean)
+
+    if allow_short:
+        inv = np.linalg.pinv(cov)
+        ones = np.ones(n)
+        a, b, c = ones @ inv @ ones, ones @ inv @ mean, mean @ inv @ mean
+        d = a * c - b * b
+        low = b / a
+        targets = np.linspace(low, low + 2 * (mean.max() - low), points)
+        # w(target) = g + h * target, solved for all targets at once
+        g = (c * inv @ ones - b * inv @ mean) / d
+        h = (a * inv @ mean - b * inv @ ones) / d
+        weights = g[None, :] + targets[:, None] * h[None, :]
+    else:
+        min_weights = _min_variance_weights(cov)
+        targets = np.linspace(min_weights @ mean, mean.max(), points)
+        weights = np.empty((points, n))
+        start = min_weights
+        for i, target in enumerate(targets):
+            start = weights[i] = _min_variance_weights(cov, mean, target, start=start)
+
+    volatilities = np.sqrt(np.einsum('ij,jk,ik->i', weights, cov, weights))
+    return targets, volatilities, weights
+
+
+def max_sharpe_weights(mean, cov, risk_free=0.0, allow_short=False):
+    """Tangency portfolio: the weights with the highest Sharpe ratio"""
+    mean = np.asarray(mean, dtype=float)
+    cov = np.asarray(cov, dtype=float)
+    n = len(mean)
+    excess = mean - risk_free
+
+    def negative_sharpe(w):
+        volatility = np.sqrt(w @ cov @ w)
+        return -(w @ excess) / volatility
+
+    def gradient(w):
+        variance = w @ cov @ w
+        volatility = np.sqrt(variance)
+        return -(excess * volatility - (w @ excess) * (cov @ w) / volatility) / variance
+
+    result = minimize(
+        negative_sharpe, np.full(n, 1 / n), jac=gradient, method='SLSQP',
+        constraints=[{'type': 'eq', 'fun': lambda w: w.sum() - 1, 'jac': lambda w: np.ones(n)}],
+        bounds=None if allow_short else [(0.0, 1.0)] * n,
+        options={'maxiter': 300, 'ftol': 1e-12},
+    )
+    return result.x
+
+
+# =============================================================================
+# INVESTMENT PROJECTIONS
+# =============================================================================
+
+def project_investment(initial, monthly, years, annual_return, contribution_increase=0.0, monthly_steps=False):
+    """Portfolio value and total contributions at the end of every year (or month).
+
+    Contributions go in at the start of every month and grow once a year by
+    contribution_increase percent; annual_return is a percentage compounded
+    monthly. Every argument may be an array: they broadcast into scenarios on
+    the leading axes, with time on the last axis. Scenarios can have different
+    years; series run to the longest horizon and the final_* entries are read
+    at each scenario's own horizon.
+    """
+    initial = np.asarray(initial, dtype=float)
+    monthly = np.asarray(monthly, dtype=float)
+    years = np.asarray(years, dtype=int)
+    rate = np.asarray(annual_return, dtype=float)[..., None] / 100 / 12
+    growth = 1 + np.asarray(contribution_increase, dtype=float)[..., None] / 100
+    shape = np.broadcast_shapes(initial.shape, monthly.shape, years.shape, rate.shape[:-1], growth.shape[:-1])
+    horizon = int(years.max()) if years.size else 0
+
+    q = 1 + rate
+    year_growth = q ** 12
+    year = np.arange(1, horizon + 1)
+    # This year's monthly contribution, and what twelve monthly payments of 1 grow to by year end
+    year_contribution = monthly[..., None] * growth ** (year - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annuity = np.where(rate == 0, 12.0, q * (year_growth - 1) / rate)
+
+    # V_y = A**y * (V_0 + annuity * sum_k c_k * A**-k): the year-by-year recurrence as one cumulative sum
+    value = year_growth ** year * (
+        initial[..., None] + annuity * np.cumsum(year_contribution * year_growth ** -year, axis=-1)
+    )
+    contributions = initial[..., None] + 12 * np.cumsum(year_contribution, axis=-1)
+    value, contributions = np.broadcast_arrays(value, contributions)
+    value = np.broadcast_to(value, shape + (horizon,))
+    contributions = np.broadcast_to(contributions, shape + (horizon,))
+
+    start = np.broadcast_to(initial, shape)[..., None]
+    final_at = np.broadcast_to(years, shape)[..., None]
+    final_value = np.take_along_axis(np.concatenate([start, value], axis=-1), final_at, axis=-1)[..., 0]
+    final_contributions = np.take_along_axis(np.concatenate([start, contributions], axis=-1), final_at, axis=-1)[..., 0]
+
+    if monthly_steps:
+        # Month j of a year starts from last year's closing value and this year's contribution
+        month = np.arange(1, 12 * horizon + 1)
+        year_index = (month - 1) // 12
+        j = month - 12 * year_index
+        with np.errstate(divide='ignore', invalid='ignore'):
+            partial = np.where(rate == 0, j, q * (q ** j - 1) / rate)
+        opening = np.concatenate([start, value[..., :-1]], axis=-1)[..., year_index]
+        paid_before = np.concatenate([start, contributions[..., :-1]], axis=-1)[..., year_index]
+        contribution = year_contribution[..., year_index]
+        value = opening * q ** j + contribution * partial
+        contributions = paid_before + contribution * j
+        value = np.broadcast_to(value, shape + (12 * horizon,))
+        contributions = np.broadcast_to(contributions, shape + (12 * horizon,))
+
+    return {
+        'value': value,
+        'contributions': contributions,
+        'final_value': final_value,
+        'final_contributions': final_contributions,
+    }
+
+
+def _geometric_sum(log_ratio, n):
+    """sum of exp(log_ratio * k) for k = 0 .. n-1, stable when the ratio is close to 1"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(log_ratio == 0, n, np.expm1(n * log_ratio) / np.expm1(log_ratio))
+
+
+def final_investment_value(initial, monthly, years, annual_return, contribution_increase=0.0):
+    """Final value and total contributions of project_investment in closed form.
+
+    No time axis is built, so grids of millions of scenarios stay cheap.
+    """
+    initial = np.asarray(initial, dtype=float)
+    monthly = np.asarray(monthly, dtype=float)
+    years = np.asarray(years, dtype=float)
+    rate = np.asarray(annual_return, dtype=float) / 100 / 12
+    log_year_growth = 12 * np.log1p(rate)
+    log_increase = np.log1p(np.asarray(contribution_increase, dtype=float) / 100)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annuity = np.where(rate == 0, 12.0, (1 + rate) * np.expm1(log_year_growth) / rate)
+
+    # V_n = A**n * V_0 + annuity * sum_k c_k * A**(n-k), with c_k = monthly * g**(k-1)
+    contributions_value = monthly * annuity * np.exp((years - 1) * log_year_growth) * _geometric_sum(log_increase - log_year_growth, years)
+    future_value = np.exp(years * log_year_growth) * initial + contributions_value
+    total_contributions = initial + 12 * monthly * _geometric_sum(log_increase, years)
+    return future_value, total_contributions
+
+
+def investment_outcomes(initial, monthly, years, annual_return, inflation=0.0, contribution_increase=0.0, tax_rate=0.0,
+                        with_projection=True):
+    """Final value, gains, taxes and inflation-adjusted value for arrays of scenarios.
+
+    Gains are taxed once at the end; the real value deflates the after-tax value
+    by inflation over each scenario's horizon. Without the projection only the
+    closed-form finals are computed.
+    """
+    if with_projection:
+        projection = project_investment(initial, monthly, years, annual_return, contribution_increase)
+        future_value = projection['final_value']
+        total_contributions = projection['final_contributions']
+    else:
+        projection = None
+        future_value, total_contributions = final_investment_value(initial, monthly, years, annual_return, contribution_increase)
+    interest_earned = future_value - total_contributions
+    taxes_paid = interest_earned * (np.asarray(tax_rate, dtype=float) / 100)
+    after_tax = future_value - taxes_paid
+    real_value = after_tax / (1 + np.asarray(inflation, dtype=float) / 100) ** np.asarray(years)
+    return {
+        'future_value': future_value,
+        'real_value': real_value,
+        'after_tax': after_tax,
+        'interest_earned': interest_earned,
+        'taxes_paid': taxes_paid,
+        'total_contributions': total_contributions,
+        'projection': projection,
+    }
+
+
+GOAL_MEASURES = ('future_value', 'after_tax', 'real_value')
+GOAL_TOLERANCE = 1e-6  # percentage points for solved returns
+RETURN_BRACKET = (-50.0, 100.0)  # annual returns searched, in percent
+
+
+def _bisect(evaluate, target, low, high, tolerance=GOAL_TOLERANCE):
+    """x in [low, high] with evaluate(x) == target for every target at once, evaluate increasing.
+
+    Every step is one vectorized evaluation for the whole array of targets.
+    Targets outside [evaluate(low), evaluate(high)] give NaN.
+    """
+    target = np.asarray(target, dtype=float)
+    steps = int(np.ceil(np.log2((high - low) / tolerance)))
+    low = np.full(target.shape, float(low))
+    high = np.full(target.shape, float(high))
+    bracketed = (evaluate(low) <= target) & (target <= evaluate(high))
+    for _ in range(steps):
+        middle = (low + high) / 2
+        below = evaluate(middle) < target
+        low = np.where(below, middle, low)
+        high = np.where(below, high, middle)
+    return np.where(bracketed, (low + high) / 2, np.nan)
+
+
+def required_contribution(target, initial, years, annual_return, inflation=0.0, contribution_increase=0.0,
+                          tax_rate=0.0, measure='after_tax'):
+    """Monthly contribution that grows to each target after years; 0 where the initial amount already does.
+
+    Every outcome is linear in the contribution, so two closed-form
+    evaluations solve the whole array of targets exactly.
+    """
+    args = (years, annual_return, inflation, contribution_increase, tax_rate)
+    base = investment_outcomes(initial, 0.0, *args, with_projection=False)[measure]
+    per_dollar = investment_outcomes(initial, 1.0, *args, with_projection=False)[measure] - base
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.maximum((np.asarray(target, dtype=float) - base) / per_dollar, 0.0)
+
+
+def required_return(target, initial, monthly, years, inflation=0.0, contribution_increase=0.0, tax_rate=0.0,
+                    measure='after_tax', bracket=RETURN_BRACKET):
+    """Annual return in percent that grows the plan to each target; NaN outside the bracket"""
+    def evaluate(annual_return):
+        return investment_outcomes(initial, monthly, years, annual_return, inflation, contribution_increase,
+                                   tax_rate, with_projection=False)[measure]
+    return _bisect(evaluate, target, *bracket)
+
+
+def years_to_target(target, initial, monthly, annual_return, inflation=0.0, contribution_increase=0.0, tax_rate=0.0,
+                    measure='after_tax', max_years=100):
+    """Years, to the month, until the plan first reaches each target; NaN if not within max_years"""
+    projection = project_investment(initial, monthly, max_years, annual_return, contribution_increase, monthly_steps=True)
+    months = np.arange(12 * max_years + 1)
+    value = np.concatenate([[float(initial)], projection['value']])
+    contributions = np.concatenate([[float(initial)], projection['contributions']])
+    outcome = {'future_value': value}
+    outcome['after_tax'] = value - (value - contributions) * tax_rate / 100
+    outcome['real_value'] = outcome['after_tax'] / (1 + inflation / 100) ** (months / 12)
+    # First month at or above the target: search the running maximum, which never decreases
+    reached = np.maximum.accumulate(outcome[measure])
+    month = np.searchsorted(reached, np.asarray(target, dtype=float), side='left')
+    return np.where(month < len(months), month / 12, np.nan)
+
+
+def retirement_savings(current_savings, annual_contribution, return_rate, years):
+    """Savings after years of annual growth with a contribution at the end of each year"""
+    growth = 1 + np.asarray(return_rate, dtype=float) / 100
+    return current_savings * growth ** years + annual_contribution * _geometric_sum(np.log(growth), years)
+
+
+def retirement_goal_seek(target, current_savings, annual_contribution, return_rate, years, bracket=RETURN_BRACKET):
+    """Annual contribution, return and years that each reach the target savings on their own.
+
+    Contribution and years have closed forms; the return is bisected. All
+    three accept arrays of targets. Targets already met need no contribution
+    and zero years; unreachable ones give NaN.
+    """
+    target = np.asarray(target, dtype=float)
+    growth = 1 + return_rate / 100
+    contribution = (target - current_savings * growth ** years) / _geometric_sum(np.log(growth), years)
+    rate = return_rate / 100
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if rate == 0:
+            years_needed = (target - current_savings) / annual_contribution
+        else:
+            # S * g**n + C * (g**n - 1) / r = T  =>  g**n = (T * r + C) / (S * r + C)
+            years_needed = np.log((target * rate + annual_contribution) / (current_savings * rate + annual_contribution)) / np.log(growth)
+    years_needed = np.where(target <= current_savings, 0.0, years_needed)
+    return {
+        'annual_contribution': np.maximum(contribution, 0.0),
+        'return_rate': _bisect(lambda r: retirement_savings(current_savings, annual_contribution, r, years), target, *bracket),
+        'years': np.where(np.isfinite(years_needed) & (years_needed >= 0), years_needed, np.nan),
+    }
+
+
+def sensitivity_grid(params, axes):
+    """investment_outcomes for every combination of the axis values, other inputs fixed.
+
+    params holds investment_outcomes keyword arguments and axes is a list of
+    (argument, values); each axis becomes one dimension of the results, in
+    order, and the whole grid is evaluated as one broadcast.
+    """
+    inputs = dict(params)
+    for dimension, (name, values) in enumerate(axes):
+        shape = [1] * len(axes)
+        shape[dimension] = -1
+        inputs[name] = np.reshape(np.asarray(values, dtype=float), shape)
+    if 'years' in inputs:
+        inputs['years'] = np.asarray(inputs['years']).astype(int)
+    outcomes = investment_outcomes(**inputs, with_projection=False)
+    shape = tuple(len(values) for _, values in axes)
+    return {name: np.broadcast_to(value, shape) for name, value in outcomes.items() if value is not None}
+
+
+# investment_outcomes inputs that define a scenario, in its argument order
+SCENARIO_FIELDS = ('initial', 'monthly', 'years', 'annual_return', 'inflation', 'contribution_increase', 'tax_rate')
+
+# Evaluated scenarios keyed by their inputs, so an edited scenario doesn't recompute the others
+_scenario_cache = LRUCache(maxsize=256)
+
+
+def scenario_key(scenario):
+    """Hashable key of the inputs that determine a scenario's outcome"""
+    return tuple(float(scenario.get(field, 0.0)) for field in SCENARIO_FIELDS)
+
+
+def compare_scenarios(scenarios):
+    """Outcomes and yearly projection for each scenario dict of investment_outcomes arguments.
+
+    Scenarios seen before come from a cache keyed by their inputs; all the
+    others are evaluated together as arrays in one investment_outcomes call.
+    Returns one result dict per scenario, in order, plus how many were evaluated.
+    """
+    keys = [scenario_key(scenario) for scenario in scenarios]
+    results = {key: _scenario_cache.get(key) for key in keys}
+    missing = [key for key, result in results.items() if result is None]
+
+    if missing:
+        inputs = np.array(missing).T
+        outcomes = investment_outcomes(*inputs[:2], inputs[2].astype(int), *inputs[3:])
+        projection = outcomes.pop('projection')
+        for i, key in enumerate(missing):
+            years = int(key[2])
+            result = {name: float(values[i]) for name, values in outcomes.items()}
+            result['value'] = projection['value'][i, :years].copy()
+            result['contributions'] = projection['contributions'][i, :years].copy()
+            result['value'].flags.writeable = result['contributions'].flags.writeable = False
+            _scenario_cache.put(key, result)
+            results[key] = result
+
+    return [results[key] for key in keys], len(missing)
+
+
+# =============================================================================
+# MONTE CARLO SIMULATION
+# =============================================================================
+
+MONTE_CARLO_PERCENTILES = (5, 25, 50, 75, 95)
+MONTE_CARLO_CHUNK = 100_000  # paths per block; fixed so results don't depend on the worker count
+SKETCH_ACCURACY = 0.002  # relative error of the streamed percentiles
+SKETCH_FLOOR = 1.0  # values below one dollar count as an empty portfolio
+BOOTSTRAP_BLOCK = 12  # months resampled together, keeps a year of autocorrelation intact
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with bounded relative error.
+
+    Positive values fall into logarithmic buckets of width 1 + 2 * accuracy,
+    so any quantile comes back within the given relative error and two
+    sketches merge by adding their counts. Values below the floor are only
+    counted. Memory grows with the log of the value range, not the count.
+    """
+
+    def __init__(self, accuracy=SKETCH_ACCURACY, floor=SKETCH_FLOOR):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.floor = floor
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.low_count = 0
+
+    @property
+    def count(self):
+        return self.low_count + int(self.counts.sum())
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        above = values[values >= self.floor]
+        self.low_count += len(values) - len(above)
+        if len(above):
+            keys = np.ceil(np.log(above) / np.log(self.gamma)).astype(np.int64)
+            self._add_counts(int(keys.min()), np.bincount(keys - keys.min()))
+
+    def merge(self, other):
+        self.low_count += other.low_count
+        if len(other.counts):
+            self._add_counts(other.offset, other.counts)
+
+    def _add_counts(self, offset, counts):
+        if not len(self.counts):
+            self.offset, self.counts = offset, counts.astype(np.int64)
+            return
+        low = min(self.offset, offset)
+        high = max(self.offset + len(self.counts), offset + len(counts))
+        merged = np.zeros(high - low, dtype=np.int64)
+        merged[self.offset - low:self.offset - low + len(self.counts)] += self.counts
+        merged[offset - low:offset - low + len(counts)] += counts
+        self.offset, self.counts = low, merged
+
+    def quantiles(self, qs):
+        """Values at the given quantiles (0-1); values below the floor come back as 0"""
+        ranks = np.asarray(qs, dtype=float) * max(self.count - 1, 0)
+        cumulative = self.low_count + np.cumsum(self.counts)
+        buckets = np.searchsorted(cumulative, ranks, side='right')
+        # Midpoint of the bucket in relative terms
+        estimates = 2 * self.gamma ** (self.offset + buckets) / (self.gamma + 1)
+        return np.where(ranks < self.low_count, 0.0, estimates)
+
+    def fraction_below(self, value):
+        """Share of the values below value, to within one bucket"""
+        if not self.count:
+            return np.nan
+        if value < self.floor:
+            return 0.0
+        key = int(np.ceil(np.log(value) / np.log(self.gamma))) - self.offset
+        return (self.low_count + self.counts[:max(key, 0)].sum()) / self.count
+
+
+class RunningMoments:
+    """Count, mean and sum of squared deviations, merged pairwise (Chan et al.)"""
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = np.asarray(mean, dtype=float)
+        self.m2 = np.asarray(m2, dtype=float)
+
+    @classmethod
+    def of(cls, values, axis=-1):
+        values = np.asarray(values, dtype=float)
+        mean = values.mean(axis=axis)
+        deviations = values - np.expand_dims(mean, axis)
+        return cls(values.shape[axis], mean, np.einsum('...i,...i->...', deviations, deviations))
+
+    def merge(self, other):
+        if not other.count:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / total
+        self.mean = self.mean + delta * other.count / total
+        self.count = total
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(self.count - 1, 1))
+
+
+def _monthly_log_returns(expected_return, volatility):
+    """Monthly log-return drift and volatility matching an annual mean and volatility in percent"""
+    # Same nominal rate compounded monthly as project_investment, so zero volatility reproduces it
+    mean = (1 + np.asarray(expected_return, dtype=float) / 1200) ** 12 - 1
+    std = np.asarray(volatility, dtype=float) / 100
+    # Lognormal annual growth with E[1 + R] = 1 + mean and sd[R] = std
+    log_variance = np.log1p(std ** 2 / (1 + mean) ** 2)
+    log_drift = np.log1p(mean) - log_variance / 2
+    return log_drift / 12, np.sqrt(log_variance / 12)
+
+
+def investment_cashflows(monthly_contribution, years, contribution_increase=0.0):
+    """Monthly contribution in force during each year, growing once a year"""
+    return monthly_contribution * (1 + contribution_increase / 100) ** np.arange(years)
+
+
+def retirement_cashflows(annual_contribution, years_to_retirement, retirement_years, annual_income, inflation=0.0):
+    """Monthly cash flow per year: contributions until retirement, then inflation-indexed withdrawals"""
+    years = np.arange(years_to_retirement + retirement_years)
+    withdrawals = -annual_income * (1 + inflation / 100) ** years / 12
+    return np.where(years < years_to_retirement, annual_contribution / 12, withdrawals)
+
+
+def monthly_log_returns(closes, weights=None):
+    """Monthly log returns of a Close series, or of a portfolio rebalanced monthly.
+
+    closes is a Series or maps ticker -> Close Series; weights default to equal.
+    """
+    if isinstance(closes, pd.Series):
+        closes = {closes.name: closes}
+    month_ends = {ticker: close.resample(pd.offsets.MonthEnd()).last() for ticker, close in closes.items()}
+    returns = return_matrix(month_ends).dropna()
+    weights = np.full(returns.shape[1], 1 / returns.shape[1]) if weights is None else np.asarray(weights, dtype=float)
+    return np.log1p(returns.to_numpy() @ weights)
+
+
+class NormalReturns:
+    """Lognormal monthly returns with a given annual mean and volatility in percent"""
+
+    def __init__(self, expected_return, volatility):
+        self.drift, self.volatility = _monthly_log_returns(expected_return, volatility)
+
+    def years(self, rng, paths):
+        """Yield a months x paths block of log returns for each year"""
+        while True:
+            # Single precision for the draws halves the memory traffic; values accumulate in double
+            log_returns = rng.standard_normal((12, paths), dtype=np.float32)
+            log_returns *= self.volatility
+            log_returns += self.drift
+            yield log_returns
+
+
+class BlockBootstrapReturns:
+    """Monthly log returns resampled from history in blocks of consecutive months.
+
+    Each path jumps to a random month every block months and then replays the
+    months that followed it, wrapping around at the end of the history, so
+    momentum, volatility clustering and fat tails carry over. With an
+    expected return, the history is shifted to that mean and keeps its shape.
+    """
+
+    def __init__(self, log_returns, block=BOOTSTRAP_BLOCK, expected_return=None):
+        log_returns = np.asarray(log_returns, dtype=float)
+        if expected_return is not None:
+            log_returns = log_returns + np.log1p(expected_return / 1200) - np.log(np.exp(log_returns).mean())
+        self.log_returns = log_returns.astype(np.float32)
+        self.block = max(1, min(int(block), len(log_returns)))
+
+    def years(self, rng, paths):
+        """Yield a months x paths block of log returns for each year"""
+        history = len(self.log_returns)
+        month = 0
+        starts = np.empty((0, paths), dtype=np.int64)
+        while True:
+            months = month + np.arange(12)
+            first, last = month // self.block, months[-1] // self.block
+            # A block started last year keeps its start, every new block jumps to a random month
+            carried = starts[-1:] if month % self.block else starts[:0]
+            fresh = rng.integers(history, size=(last - first + 1 - len(carried), paths))
+            starts = np.concatenate([carried, fresh])
+            indices = starts[months // self.block - first] + (months % self.block)[:, None]
+            month += 12
+            yield self.log_returns[indices % history]
+
+
+def _simulate_paths(rng, paths, initial, cashflows, model):
+    """Yield the value of every path at the start and at each year end.
+
+    Each year draws a months x paths block, so memory stays at 12 x paths
+    however long the horizon. Portfolios that run dry stay empty.
+    """
+    value = np.full(paths, float(initial))
+    yield value
+    for contribution, log_growth in zip(cashflows, model.years(rng, paths)):
+        # Months x paths, so the running sum adds whole contiguous rows
+        np.cumsum(log_growth, axis=0, out=log_growth)
+        # V_12 = G_12 * (V_0 + c * sum_k 1/G_k) with G_0 = 1: cash flows at the start of each month
+        discount = np.exp(-log_growth[:-1]).sum(axis=0, dtype=float) + 1
+        value = np.exp(log_growth[-1].astype(float)) * (value + contribution * discount)
+        np.maximum(value, 0, out=value)
+        yield value
+
+
+def _simulate_chunk(seed, paths, initial, cashflows, model):
+    """One block of paths folded into a quantile sketch and moments per year"""
+    sketches, means, m2s = [], [], []
+    for value in _simulate_paths(np.random.default_rng(seed), paths, initial, cashflows, model):
+        sketch = QuantileSketch()
+        sketch.add(value)
+        moments = RunningMoments.of(value)
+        sketches.append(sketch)
+        means.append(moments.mean)
+        m2s.append(moments.m2)
+    return sketches, RunningMoments(paths, means, m2s)
+
+
+def simulate_cashflows(initial, cashflows, model, simulations=100_000, seed=None, percentiles=MONTE_CARLO_PERCENTILES):
+    """Monte Carlo of a portfolio with a monthly cash flow per year and monthly returns drawn from model.
+
+    Paths run in fixed-size blocks with independent random streams spawned
+    from the seed, on the shared process pool when there is more than one
+    block. Each block is reduced to a quantile sketch and running moments per
+    year before it comes back, so memory stays constant however many paths
+    run, and the same seed gives the same result for any worker count.
+    """
+    cashflows = np.asarray(cashflows, dtype=float)
+    sizes = [min(MONTE_CARLO_CHUNK, simulations - start) for start in range(0, simulations, MONTE_CARLO_CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = (repeat(initial), repeat(cashflows), repeat(model))
+    if len(sizes) <= 1 or SWEEP_WORKERS == 1:
+        results = map(_simulate_chunk, seeds, sizes, *args)
+    else:
+        results = get_process_pool().map(_simulate_chunk, seeds, sizes, *args)
+
+    # Blocks are folded in order as they finish, so only the running totals are held
+    sketches, moments = None, RunningMoments()
+    for chunk_sketches, chunk_moments in results:
+        if sketches is None:
+            sketches = chunk_sketches
+        else:
+            for sketch, chunk_sketch in zip(sketches, chunk_sketches):
+                sketch.merge(chunk_sketch)
+        moments.merge(chunk_moments)
+
+    bands = np.array([sketch.quantiles(np.asarray(percentiles) / 100) for sketch in sketches]).T
+    return {
+        'years': np.arange(len(cashflows) + 1),
+        'simulations': simulations,
+        'percentiles': dict(zip(percentiles, bands)),
+        'mean': moments.mean,
+        'std': moments.std,
+        'final': sketches[-1],
+    }
+
+
+def return_model(expected_return, volatility, historical_returns=None, block=BOOTSTRAP_BLOCK, match_expected_return=True):
+    """Normal returns, or a block bootstrap of historical monthly log returns when they are given"""
+    if historical_returns is None:
+        return NormalReturns(expected_return, volatility)
+    return BlockBootstrapReturns(historical_returns, block, expected_return if match_expected_return else None)
+
+
+def simulate_investment(initial, monthly_contribution, years, expected_return, volatility,
+                        simulations=100_000, contribution_increase=0.0, seed=None,
+                        percentiles=MONTE_CARLO_PERCENTILES, **history):
+    """Monte Carlo of a portfolio with growing monthly contributions.
+
+    Returns percentile bands, mean and standard deviation of the portfolio
+    value at the start and at every year end, plus a sketch of the final values.
+    Extra keyword arguments go to return_model to resample historical returns.
+    """
+    cashflows = investment_cashflows(monthly_contribution, years, contribution_increase)
+    model = return_model(expected_return, volatility, **history)
+    return simulate_cashflows(initial, cashflows, model, simulations, seed, percentiles)
+
+
+def simulate_retirement(current_savings, annual_contribution, years_to_retirement, retirement_years,
+                        annual_income, expected_return, volatility, inflation=0.0, simulations=100_000,
+                        seed=None, percentiles=MONTE_CARLO_PERCENTILES, **history):
+    """Monte Carlo of saving until retirement and then drawing an inflation-indexed income.
+
+    Same result as simulate_investment, plus the share of paths whose savings
+    last through retirement.
+    """
+    cashflows = retirement_cashflows(annual_contribution, years_to_retirement, retirement_years, annual_income, inflation)
+    model = return_model(expected_return, volatility, **history)
+    simulation = simulate_cashflows(current_savings, cashflows, model, simulations, seed, percentiles)
+    simulation['success_rate'] = 1 - simulation['final'].low_count / simulation['final'].count
+    return simulation
+
+
+# =============================================================================
+# CHART DOWNSAMPLING
+# =============================================================================
+
+# Roughly one point per horizontal pixel of a wide chart
+CHART_MAX_POINTS = 1000
+
+# Candle sizes tried in order when there are too many daily bars to draw
+CANDLE_SIZES = [
+    ("Daily", None),
+    ("Weekly", pd.offsets.Week(weekday=4)),
+    ("Monthly", pd.offsets.MonthEnd()),
+    ("Quarterly", pd.offsets.QuarterEnd()),
+]
+
+
+def downsample_ohlcv(hist, max_bars=CHART_MAX_POINTS):
+    """Aggregate daily bars into the smallest candle size that fits in max_bars.
+
+    Returns (bars, label) where label names the candle size used.
+    """
+    for label, offset in CANDLE_SIZES:
+        if offset is None:
+            bars = hist
+        else:
+            bars = hist.resample(offset).agg({
+                'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'
+            }).dropna(subset=['Close'])
+        if len(bars) <= max_bars:
+            break
+    return bars, label
+
+
+def lttb_indices(x, y, threshold=CHART_MAX_POINTS):
+    """Largest-Triangle-Three-Buckets: indices of the points that keep a line's shape.
+
+    NaN points (e.g. an indicator's warm-up) are dropped first.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= threshold or threshold < 3:
+        return valid
+
+    xs, ys = x[valid], y[valid]
+    edges = np.linspace(1, len(valid) - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, len(valid) - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The next bucket's average is the third corner of the triangle
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else len(valid)
+        avg_x = xs[end:next_end].mean()
+        avg_y = ys[end:next_end].mean()
+        areas = np.abs(
+            (xs[previous] - avg_x) * (ys[start:end] - ys[previous])
+            - (xs[previous] - xs[start:end]) * (avg_y - ys[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return valid[selected]
+
+
+# =============================================================================
+# FIGURE CACHE
+# =============================================================================
+
+# Built Plotly figures shared by all sessions, capped by the size of their data arrays
+_figure_cache = LRUCache(maxsize=256, max_bytes=64 * 1024 * 1024)
+
+
+FIGURE_DATA_FIELDS = ('x', 'y', 'z', 'text', 'customdata')
+FIGURE_OVERHEAD = 16 * 1024  # bytes allowed for the layout and trace settings
+
+
+def figure_size(fig):
+    """Rough memory size of a figure from its data arrays, without serializing it"""
+    size = FIGURE_OVERHEAD
+    for trace in fig.data:
+        for field in FIGURE_DATA_FIELDS:
+            values = getattr(trace, field, None)
+            if values is not None and not isinstance(values, str):
+                size += np.asarray(values).nbytes
+    return size
+
+
+def cached_figure(key, build_figure):
+    """Return the figure built for key, only calling build_figure on a miss.
+
+    key must capture every input of the chart. Cached figures are shared, so
+    callers must not modify them.
+    """
+    fig = _figure_cache.get(key)
+    if fig is None:
+        fig = build_figure()
+        _figure_cache.put(key, fig, size=figure_size(fig))
+    return fig
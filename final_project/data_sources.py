@@ -0,0 +1,401 @@
+import abc
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+import pandas as pd
+import requests
+import yfinance as yf
+
+from market_data import HOST_BUDGETS, TokenBucket, UpstreamError, check_symbol, get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# DATA SOURCE INTERFACE
+# =============================================================================
+
+# Free exchange-rate providers, tried in order
+FX_PROVIDERS = {
+    "exchangerate-api": "https://api.exchangerate-api.com/v4/latest/{base}",
+    "open.er-api": "https://open.er-api.com/v6/latest/{base}",
+}
+
+
+class MarketDataSource(abc.ABC):
+    """Where the calculators get prices, fundamentals and exchange rates from.
+
+    Every method is one upstream request. Callers wrap them in call_upstream with
+    host(name) and limiter(name) so rate limits and circuit breakers apply per
+    source and provider.
+    """
+
+    name = "base"
+
+    def host(self, provider):
+        """Circuit breaker key for a provider of this source"""
+        return provider
+
+    def limiter(self, provider):
+        """Token bucket for calls to a provider of this source, None if it is unlimited"""
+        return get_rate_limiter(self.host(provider))
+
+    @abc.abstractmethod
+    def price_history(self, ticker, start=None):
+        """Daily bars for a ticker: full history, or only from start onwards"""
+
+    def price_histories(self, tickers, start=None):
+        """Daily bars for several tickers as {ticker: DataFrame}, skipping unknown ones"""
+        histories = {}
+        for ticker in tickers:
+            hist = self.price_history(ticker, start)
+            if hist is not None and not hist.empty:
+                histories[ticker] = hist
+        return histories
+
+    @abc.abstractmethod
+    def intraday_bars(self, ticker, interval, start=None):
+        """Today's intraday bars at interval (e.g. "1m"), or only those from start onwards"""
+
+    @abc.abstractmethod
+    def company_info(self, ticker):
+        """Ticker.info style fundamentals dictionary"""
+
+    @abc.abstractmethod
+    def rate_table(self, provider, base_currency):
+        """Latest rates for base_currency from one FX provider, as {'rates': {...}}"""
+
+
+class LiveSource(MarketDataSource):
+    """Yahoo Finance and the free exchange-rate APIs"""
+
+    name = "live"
+
+    def price_history(self, ticker, start=None):
+        period_args = {'period': 'max'} if start is None else {'start': start}
+        return yf.Ticker(ticker).history(**period_args)
+
+    def price_histories(self, tickers, start=None):
+        period_args = {'period': 'max'} if start is None else {'start': start}
+        data = yf.download(
+            list(tickers), group_by='ticker', auto_adjust=True, ignore_tz=False,
+            progress=False, **period_args
+        )
+
+        histories = {}
+        for ticker in tickers:
+            if ticker in data.columns.get_level_values(0):
+                # Tickers are aligned on a shared calendar, drop the days one of them didn't trade
+                hist = data[ticker].dropna(subset=['Close'])
+                if not hist.empty:
+                    histories[ticker] = hist
+        return histories
+
+    def intraday_bars(self, ticker, interval, start=None):
+        period_args = {'period': '1d'} if start is None else {'start': start}
+        return yf.Ticker(ticker).history(interval=interval, **period_args)
+
+    def company_info(self, ticker):
+        return yf.Ticker(ticker).info
+
+    def rate_table(self, provider, base_currency):
+        api_url = FX_PROVIDERS[provider].format(base=base_currency)
+        response = requests.get(api_url, timeout=10)
+        # Any status but 200 counts as a failure for the circuit breaker
+        if response.status_code != 200:
+            raise UpstreamError(f"{api_url} answered with HTTP {response.status_code}")
+        return response.json()
+
+
+# =============================================================================
+# RECORDED FIXTURES
+# =============================================================================
+
+# Replayed intraday fixtures start this far in and then advance in real time
+REPLAY_HEAD = pd.Timedelta(hours=1)
+
+
+def _fixture_paths(root):
+    return {
+        "history": os.path.join(root, "history"),
+        "intraday": os.path.join(root, "intraday"),
+        "info": os.path.join(root, "info"),
+        "fx": os.path.join(root, "fx"),
+    }
+
+
+def _fixture_file(folder, symbol, extension):
+    """Path of the fixture for a ticker or currency symbol, which is checked before it names a file"""
+    return os.path.join(folder, f"{check_symbol(symbol)}.{extension}")
+
+
+def _since(hist, start):
+    """Copy of the bars on or after the start date, like history(start=...)"""
+    if start is not None:
+        hist = hist[hist.index.normalize() >= pd.Timestamp(start).tz_localize(hist.index.tz)]
+    return hist.copy()
+
+
+class ReplaySource(MarketDataSource):
+    """Serve recorded fixtures with simulated latency and injected failures.
+
+    Fixtures live under root as history/<TICKER>.csv (bars indexed by UTC time)
+    with history/<TICKER>.json holding the exchange timezone, the same pair under
+    intraday/, info/<TICKER>.json and fx/<provider>/<BASE>.json. RecordingSource
+    writes this layout. Intraday bars are played back as a live feed: the first
+    hour is there from the start and later bars appear as real time passes.
+
+    latency is a fixed delay in seconds or a (low, high) range drawn per call.
+    error_rate is the chance that any call fails, and failing_providers makes
+    every call to those providers fail, to simulate an outage. A seed makes the
+    delays and failures reproducible between runs.
+    """
+
+    name = "replay"
+
+    def __init__(self, root, latency=0.0, error_rate=0.0, failing_providers=(), seed=None, throttle=False):
+        self.root = root
+        self.paths = _fixture_paths(root)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failing_providers = set(failing_providers)
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._bars = {}
+        self._started = pd.Timestamp.now(tz="UTC")
+
+        # Fixtures aren't rate-limited unless asked to behave like the real hosts
+        self._limiters = {
+            provider: TokenBucket(*HOST_BUDGETS[provider]) if throttle else None
+            for provider in ["yfinance", *FX_PROVIDERS]
+        }
+
+    def host(self, provider):
+        return f"replay:{provider}"
+
+    def limiter(self, provider):
+        return self._limiters[provider]
+
+    def _simulate(self, provider):
+        """Sleep for the configured latency, then maybe fail like an upstream would"""
+        with self._random_lock:
+            if isinstance(self.latency, (tuple, list)):
+                delay = self._random.uniform(*self.latency)
+            else:
+                delay = self.latency
+            fail = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail or provider in self.failing_providers:
+            raise UpstreamError(f"Injected failure from {provider}")
+
+    def _read_json(self, path, missing_message):
+        if not os.path.exists(path):
+            raise UpstreamError(missing_message)
+        with open(path) as f:
+            return json.load(f)
+
+    def _load_bars(self, kind, ticker):
+        # Fixtures never change during a run, parse each CSV once
+        if (kind, ticker) not in self._bars:
+            path = _fixture_file(self.paths[kind], ticker, "csv")
+            if not os.path.exists(path):
+                self._bars[kind, ticker] = None
+            else:
+                hist = pd.read_csv(path, index_col=0)
+                hist.index = pd.to_datetime(hist.index, utc=True)
+                meta_path = _fixture_file(self.paths[kind], ticker, "json")
+                if os.path.exists(meta_path):
+                    with open(meta_path) as f:
+                        tz = json.load(f).get("tz")
+                    if tz:
+                        hist.index = hist.index.tz_convert(tz)
+                hist.index.name = "Date" if kind == "history" else "Datetime"
+                self._bars[kind, ticker] = hist
+        return self._bars[kind, ticker]
+
+    def _load_history(self, ticker):
+        return self._load_bars("history", ticker)
+
+    def price_history(self, ticker, start=None):
+        self._simulate("yfinance")
+        hist = self._load_history(ticker)
+        if hist is None:
+            # yfinance answers unknown tickers with an empty frame rather than an error
+            return pd.DataFrame(columns=["Open", "High", "Low", "Close", "Volume"])
+        return _since(hist, start)
+
+    def price_histories(self, tickers, start=None):
+        # One batched request upstream, so one delay and one chance of failure
+        self._simulate("yfinance")
+        histories = {}
+        for ticker in tickers:
+            hist = self._load_history(ticker)
+            if hist is None:
+                continue
+            hist = _since(hist, start)
+            if not hist.empty:
+                histories[ticker] = hist
+        return histories
+
+    def intraday_bars(self, ticker, interval, start=None):
+        self._simulate("yfinance")
+        bars = self._load_bars("intraday", ticker)
+        if bars is None:
+            return pd.DataFrame(columns=["Open", "High", "Low", "Close", "Volume"])
+        # Only reveal the bars the replayed session has reached by now
+        elapsed = pd.Timestamp.now(tz="UTC") - self._started
+        bars = bars[bars.index <= bars.index[0] + REPLAY_HEAD + elapsed]
+        if start is not None:
+            bars = bars[bars.index >= start]
+        return bars.copy()
+
+    def company_info(self, ticker):
+        self._simulate("yfinance")
+        path = _fixture_file(self.paths["info"], ticker, "json")
+        return self._read_json(path, f"No recorded info for {ticker}")
+
+    def rate_table(self, provider, base_currency):
+        self._simulate(provider)
+        path = _fixture_file(os.path.join(self.paths["fx"], provider), base_currency, "json")
+        return self._read_json(path, f"No recorded {provider} rates for {base_currency}")
+
+
+class RecordingSource(MarketDataSource):
+    """Pass calls through to another source and save every answer as a replay fixture"""
+
+    name = "record"
+
+    def __init__(self, inner, root):
+        self.inner = inner
+        self.root = root
+        self.paths = _fixture_paths(root)
+        for path in self.paths.values():
+            os.makedirs(path, exist_ok=True)
+
+    def host(self, provider):
+        return self.inner.host(provider)
+
+    def limiter(self, provider):
+        return self.inner.limiter(provider)
+
+    def _write_json(self, path, payload):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f, indent=1, default=str)
+        os.replace(tmp_path, path)
+
+    def _record_history(self, ticker, hist, start, kind="history"):
+        # Only full downloads are recorded, incremental ones would cut the fixture short
+        if start is not None or hist is None or hist.empty:
+            return
+        recorded = hist.copy()
+        tz = str(recorded.index.tz) if recorded.index.tz is not None else None
+        if tz is not None:
+            recorded.index = recorded.index.tz_convert("UTC")
+        recorded.to_csv(_fixture_file(self.paths[kind], ticker, "csv"))
+        self._write_json(_fixture_file(self.paths[kind], ticker, "json"), {"tz": tz})
+
+    def price_history(self, ticker, start=None):
+        hist = self.inner.price_history(ticker, start)
+        self._record_history(ticker, hist, start)
+        return hist
+
+    def price_histories(self, tickers, start=None):
+        histories = self.inner.price_histories(tickers, start)
+        for ticker, hist in histories.items():
+            self._record_history(ticker, hist, start)
+        return histories
+
+    def intraday_bars(self, ticker, interval, start=None):
+        bars = self.inner.intraday_bars(ticker, interval, start)
+        self._record_history(ticker, bars, start, kind="intraday")
+        return bars
+
+    def company_info(self, ticker):
+        info = self.inner.company_info(ticker)
+        self._write_json(_fixture_file(self.paths["info"], ticker, "json"), info)
+        return info
+
+    def rate_table(self, provider, base_currency):
+        data = self.inner.rate_table(provider, base_currency)
+        self._write_json(_fixture_file(os.path.join(self.paths["fx"], provider), base_currency, "json"), data)
+        return data
+
+
+# =============================================================================
+# SOURCE SELECTION
+# =============================================================================
+
+def source_from_env(environ=os.environ):
+    """Build the data source described by FINLEARN_DATA_SOURCE.
+
+    "live" (the default), "replay:<fixture dir>" or "record:<fixture dir>".
+    Replay reads FINLEARN_REPLAY_LATENCY ("0.2" or "0.1-0.5" seconds),
+    FINLEARN_REPLAY_ERROR_RATE, FINLEARN_REPLAY_FAILING (comma separated
+    providers) and FINLEARN_REPLAY_SEED. Point FINLEARN_DATA_DIR somewhere else
+    too when replaying, so fixture bars don't end up in the live OHLCV store.
+    """
+    spec = environ.get("FINLEARN_DATA_SOURCE", "live")
+    kind, _, root = spec.partition(":")
+    if kind == "live":
+        return LiveSource()
+    if kind == "record":
+        return RecordingSource(LiveSource(), root)
+    if kind == "replay":
+        latency = environ.get("FINLEARN_REPLAY_LATENCY", "0")
+        low, _, high = latency.partition("-")
+        failing = environ.get("FINLEARN_REPLAY_FAILING", "")
+        seed = environ.get("FINLEARN_REPLAY_SEED")
+        return ReplaySource(
+            root,
+            latency=(float(low), float(high)) if high else float(low),
+            error_rate=float(environ.get("FINLEARN_REPLAY_ERROR_RATE", "0")),
+            failing_providers=[p.strip() for p in failing.split(",") if p.strip()],
+            seed=int(seed) if seed is not None else None,
+        )
+    raise ValueError(f"Unknown FINLEARN_DATA_SOURCE: {spec}")
+
+
+_data_source = None
+_data_source_guard = threading.Lock()
+
+
+def get_data_source():
+    """Return the process-wide data source, built from the environment on first use"""
+    global _data_source
+    with _data_source_guard:
+        if _data_source is None:
+            _data_source = source_from_env()
+        return _data_source
+
+
+def set_data_source(source):
+    """Swap the process-wide data source, e.g. to a ReplaySource in a benchmark"""
+    global _data_source
+    with _data_source_guard:
+        _data_source = source
+
+
+if __name__ == "__main__":
+    # Record fixtures for later replay: python data_sources.py <fixture dir> AAPL MSFT ...
+    if len(sys.argv) < 3:
+        sys.exit("usage: python data_sources.py <fixture dir> TICKER [TICKER ...]")
+    root, tickers = sys.argv[1], sys.argv[2:]
+    recorder = RecordingSource(LiveSource(), root)
+    for ticker in tickers:
+        recorder.price_history(ticker)
+        recorder.intraday_bars(ticker, "1m")
+        recorder.company_info(ticker)
+    for provider in FX_PROVIDERS:
+        for base in ["USD", "EUR"]:
+            try:
+                recorder.rate_table(provider, base)
+            except Exception as e:
+                logger.warning("Could not record %s rates for %s: %s", provider, base, e)
+    print(f"Recorded {len(tickers)} tickers into {root}")
@@ -0,0 +1,1033 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# LOCAL OHLCV STORE
+# =============================================================================
+
+# Root folder for persisted market data (override with FINLEARN_DATA_DIR)
+DATA_DIR = os.environ.get(
+    "FINLEARN_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".market_data")
+)
+
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+# Ticker symbols name folders and fixture files, so anything else is rejected up front.
+# Covers BRK-B, BF.B, ^GSPC and EURUSD=X; at least one letter or digit rules out "." and "..".
+SYMBOL_PATTERN = re.compile(r"(?=.*[A-Z0-9])[A-Z0-9.^=-]{1,15}")
+
+
+def is_valid_symbol(symbol):
+    """True if symbol is an upper-case ticker symbol that is safe to use as a file name"""
+    return isinstance(symbol, str) and SYMBOL_PATTERN.fullmatch(symbol) is not None
+
+
+def check_symbol(symbol):
+    """Return symbol, or raise ValueError if it isn't a valid ticker symbol"""
+    if not is_valid_symbol(symbol):
+        raise ValueError(f"Invalid ticker symbol: {symbol!r}")
+    return symbol
+
+# How far back each period selectbox value reaches from the latest bar
+PERIOD_OFFSETS = {
+    "1mo": relativedelta(months=1),
+    "3mo": relativedelta(months=3),
+    "6mo": relativedelta(months=6),
+    "1y": relativedelta(years=1),
+    "2y": relativedelta(years=2),
+    "5y": relativedelta(years=5),
+    "10y": relativedelta(years=10),
+    "max": None,
+}
+
+
+def period_start(last_timestamp, period):
+    """Return the first timestamp a period reaches back to from the latest bar, or None for max"""
+    offset = PERIOD_OFFSETS.get(period)
+    if offset is None:
+        return None
+    return last_timestamp.normalize() - offset
+
+
+def slice_period(hist, period):
+    """Slice a full history DataFrame down to the bars covering period"""
+    if hist is None or hist.empty:
+        return hist
+    start = period_start(hist.index[-1], period)
+    if start is None:
+        return hist
+    return hist.iloc[hist.index.searchsorted(start, side="left"):]
+
+
+class OHLCVStore:
+    """Append-only per-ticker OHLCV store backed by memory-mapped NumPy arrays.
+
+    Every ticker gets its own folder with three files:
+    - index.bin: int64 bar timestamps (UTC nanoseconds)
+    - values.bin: float64 rows of Open, High, Low, Close, Volume
+    - meta.json: committed row count, exchange timezone and refresh time
+    """
+
+    def __init__(self, root=DATA_DIR):
+        self.root = root
+        self._locks = {}
+        self._sync_locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _folder(self, ticker):
+        return os.path.join(self.root, check_symbol(ticker.upper()))
+
+    def _paths(self, ticker):
+        folder = self._folder(ticker)
+        return (
+            os.path.join(folder, "index.bin"),
+            os.path.join(folder, "values.bin"),
+            os.path.join(folder, "meta.json"),
+        )
+
+    def lock(self, ticker):
+        """Return the lock guarding a ticker's files, held only while they are read or written"""
+        with self._locks_guard:
+            return self._locks.setdefault(ticker.upper(), threading.RLock())
+
+    def sync_lock(self, ticker):
+        """Return the lock held while a ticker is synced, downloads included; readers never take it"""
+        with self._locks_guard:
+            return self._sync_locks.setdefault(ticker.upper(), threading.Lock())
+
+    def read_meta(self, ticker):
+        """Read the metadata for a ticker, or an empty dict if nothing is stored"""
+        meta_path = self._paths(ticker)[2]
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, ticker, meta):
+        meta_path = self._paths(ticker)[2]
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def _arrays(self, ticker):
+        """Memory-map the committed rows of a ticker (index, values).
+
+        Callers must hold the ticker's lock while they use the maps, since
+        write truncates the files in place.
+        """
+        meta = self.read_meta(ticker)
+        rows = meta.get("rows", 0)
+        if rows == 0:
+            return None, None, meta
+        index_path, values_path, _ = self._paths(ticker)
+        index = np.memmap(index_path, dtype="<i8", mode="r", shape=(rows,))
+        values = np.memmap(values_path, dtype="<f8", mode="r", shape=(rows, len(OHLCV_COLUMNS)))
+        return index, values, meta
+
+    def last_timestamp(self, ticker):
+        """Return the timestamp of the newest stored bar, or None"""
+        with self.lock(ticker):
+            index, _, meta = self._arrays(ticker)
+            if index is None:
+                return None
+            last = int(index[-1])
+        return pd.Timestamp(last, tz="UTC").tz_convert(meta.get("tz", "UTC"))
+
+    def load(self, ticker, period="max"):
+        """Return the stored bars covering period as a DataFrame, or None"""
+        # Held until the slice is copied out, so a concurrent write can't truncate the files under the maps
+        with self.lock(ticker):
+            index, values, meta = self._arrays(ticker)
+            if index is None:
+                return None
+
+            start = 0
+            last = pd.Timestamp(int(index[-1]), tz="UTC").tz_convert(meta.get("tz", "UTC"))
+            cutoff = period_start(last, period)
+            if cutoff is not None:
+                start = int(np.searchsorted(index, cutoff.tz_convert("UTC").value, side="left"))
+
+            # Copy only the requested slice out of the memory map
+            index, values = np.array(index[start:]), np.array(values[start:])
+
+        dates = pd.to_datetime(index, utc=True).tz_convert(meta.get("tz", "UTC"))
+        hist = pd.DataFrame(values, index=dates, columns=OHLCV_COLUMNS)
+        hist.index.name = "Date"
+        return hist
+
+    def write(self, ticker, hist, replace=False):
+        """Store the bars in hist, overwriting any stored bars at or after its first timestamp"""
+        if hist is None or hist.empty:
+            return
+        index_path, values_path, _ = self._paths(ticker)
+        dates = hist.index.tz_convert("UTC") if hist.index.tz else hist.index
+        new_index = dates.as_unit("ns").asi8
+        new_values = hist[OHLCV_COLUMNS].to_numpy(dtype="<f8")
+
+        with self.lock(ticker):
+            os.makedirs(self._folder(ticker), exist_ok=True)
+            meta = {} if replace else self.read_meta(ticker)
+            keep = 0
+            if meta.get("rows"):
+                index, _, _ = self._arrays(ticker)
+                keep = int(np.searchsorted(index, new_index[0], side="left"))
+                del index
+
+            # Shrink the committed row count first so a crash never exposes half-written bars
+            meta["rows"] = keep
+            self._write_meta(ticker, meta)
+
+            with open(index_path, "ab") as f:
+                f.truncate(keep * 8)
+                f.write(np.ascontiguousarray(new_index, dtype="<i8").tobytes())
+            with open(values_path, "ab") as f:
+                f.truncate(keep * 8 * len(OHLCV_COLUMNS))
+                f.write(np.ascontiguousarray(new_values).tobytes())
+
+            meta.update({
+                "rows": keep + len(new_index),
+                "tz": str(hist.index.tz) if hist.index.tz else "UTC",
+                "refreshed_at": time.time(),
+            })
+            self._write_meta(ticker, meta)
+
+    def age(self, ticker):
+        """Seconds since the ticker was last synced, or None if nothing is stored"""
+        meta = self.read_meta(ticker)
+        if not meta.get("rows"):
+            return None
+        return time.time() - meta.get("refreshed_at", 0)
+
+    def touch(self, ticker):
+        """Mark a ticker as freshly synced without changing its bars"""
+        with self.lock(ticker):
+            meta = self.read_meta(ticker)
+            if meta:
+                meta["refreshed_at"] = time.time()
+                self._write_meta(ticker, meta)
+
+
+_ohlcv_store = None
+_ohlcv_store_guard = threading.Lock()
+
+
+def get_ohlcv_store():
+    """Return the process-wide OHLCV store"""
+    global _ohlcv_store
+    # Two stores would each have their own per-ticker locks, so only one is ever built
+    with _ohlcv_store_guard:
+        if _ohlcv_store is None:
+            _ohlcv_store = OHLCVStore()
+        return _ohlcv_store
+
+
+def sync_ticker_history(store, ticker, fetch_history, max_age=300):
+    """Bring the stored history for a ticker up to date, downloading only new bars.
+
+    fetch_history(ticker, start) must return a yfinance-style history DataFrame;
+    start is None for a full download, otherwise the first date to fetch.
+    """
+    sync_ticker_histories(
+        store, [ticker],
+        lambda tickers, start: {t: fetch_history(t, start) for t in tickers},
+        max_age
+    )
+
+
+def sync_ticker_histories(store, tickers, fetch_histories, max_age=300):
+    """Bring several tickers up to date with as few batched downloads as possible.
+
+    fetch_histories(tickers, start) must return {ticker: history DataFrame}; start
+    is None for full downloads, otherwise the first date to fetch. At most two
+    calls are made: one for the new bars of stored tickers, one for tickers that
+    need their full history (never stored, or re-adjusted upstream).
+    """
+    tickers = sorted(set(tickers))
+    # Only one sync per ticker at a time, so a second one finds it fresh instead of downloading again.
+    # Readers take store.lock, not this one, and keep serving the stored bars during the download.
+    # Always lock in sorted order so overlapping batches can't deadlock
+    locks = [store.sync_lock(ticker) for ticker in tickers]
+    for lock in locks:
+        lock.acquire()
+    try:
+        full, incremental = [], {}
+        for ticker in tickers:
+            meta = store.read_meta(ticker)
+            if meta.get("rows") and time.time() - meta.get("refreshed_at", 0) < max_age:
+                continue
+            stored = store.load(ticker, "1mo") if meta.get("rows") else None
+            if stored is None or len(stored) < 2:
+                full.append(ticker)
+            else:
+                incremental[ticker] = stored
+
+        if incremental:
+            # Re-fetch from the second-newest bar: the newest one may have been a partial session
+            # and the completed overlap bar tells us whether yfinance re-adjusted older prices
+            start = min(stored.index[-2] for stored in incremental.values()).date()
+            new_bars = fetch_histories(list(incremental), start)
+            for ticker, stored in incremental.items():
+                overlap = stored.index[-2]
+                new = new_bars.get(ticker)
+                if new is None or new.empty:
+                    store.touch(ticker)
+                    continue
+                if overlap in new.index:
+                    old_close = stored.at[overlap, "Close"]
+                    new_close = float(new.at[overlap, "Close"])
+                    if not np.isclose(old_close, new_close, rtol=1e-6):
+                        # Split or dividend adjustment changed history, start over
+                        full.append(ticker)
+                        continue
+                store.write(ticker, new[new.index >= overlap])
+
+        if full:
+            for ticker, hist in fetch_histories(full, None).items():
+                store.write(ticker, hist, replace=True)
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
+# =============================================================================
+# RATE LIMITING AND REQUEST COALESCING
+# =============================================================================
+
+REQUEST_DELAY = 2  # seconds between yfinance requests
+
+# Requests per second and burst size for every upstream host, None for no limit
+HOST_BUDGETS = {
+    "yfinance": (1 / REQUEST_DELAY, 2),
+    "exchangerate-api": (1.0, 5),
+    "open.er-api": (1.0, 5),
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket that never blocks: callers without a token are told when to retry"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, keep=0):
+        """Take a token and return 0, or return the seconds until one is available without taking it.
+
+        keep tokens are left in the bucket for other callers.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1 + keep:
+                self._tokens -= 1
+                return 0.0
+            return (1 + keep - self._tokens) / self.rate
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into a single upstream call"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn once for everyone asking for key at the same time and share its result"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+_rate_limiters = {}
+_rate_limiters_guard = threading.Lock()
+_single_flight = SingleFlight()
+
+
+def get_rate_limiter(host):
+    """Return the process-wide token bucket for an upstream host, None if it is unlimited"""
+    with _rate_limiters_guard:
+        if host not in _rate_limiters:
+            budget = HOST_BUDGETS.get(host, (1.0, 1))
+            _rate_limiters[host] = TokenBucket(*budget) if budget is not None else None
+        return _rate_limiters[host]
+
+
+def coalesce(key, fn, *args, **kwargs):
+    """Share one in-flight call to fn between all callers using the same key"""
+    return _single_flight.do(key, fn, *args, **kwargs)
+
+
+# =============================================================================
+# FAILURE BACKOFF AND CIRCUIT BREAKERS
+# =============================================================================
+
+FAILURE_BACKOFF = (15, 300)  # seconds: first retry delay, longest retry delay
+BREAKER_THRESHOLD = 3  # consecutive failures before a host is cut off
+BREAKER_COOLDOWN = (30, 600)  # seconds: first cool-down, longest cool-down
+
+
+class UpstreamError(Exception):
+    """An upstream provider failed or returned no usable data"""
+
+
+class RequestRejected(UpstreamError):
+    """The call was refused locally and never reached the upstream"""
+
+
+class RateLimitedError(RequestRejected):
+    """A host's request budget is used up; the call was not made"""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"{host} is rate limited, retry in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitOpenError(RequestRejected):
+    """Calls to a host are suspended while its circuit breaker cools down"""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"{host} is temporarily unavailable, retrying in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+def backoff_delay(attempt, base, cap):
+    """Exponential delay for the nth consecutive failure, with jitter so retries spread out"""
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class FailureBackoff:
+    """Remember recent failures per key so they are only retried after a growing delay.
+
+    This is the negative cache: while a key is backing off, callers get the last
+    error back straight away instead of calling the upstream again.
+    """
+
+    def __init__(self, base=FAILURE_BACKOFF[0], cap=FAILURE_BACKOFF[1]):
+        self.base = base
+        self.cap = cap
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def pending(self, key):
+        """Return the last error for key if it shouldn't be retried yet, else None"""
+        with self._lock:
+            failure = self._failures.get(key)
+        if failure is not None and time.monotonic() < failure[1]:
+            return failure[2]
+        return None
+
+    def record_failure(self, key, error):
+        if isinstance(error, RequestRejected):
+            return  # Our own limiter or breaker said no, the key itself hasn't failed
+        with self._lock:
+            attempts = self._failures.get(key, (0, 0, None))[0] + 1
+            retry_at = time.monotonic() + backoff_delay(attempts, self.base, self.cap)
+            self._failures[key] = (attempts, retry_at, error)
+
+    def record_success(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+class CircuitBreaker:
+    """Per-host breaker that stops calling a provider after repeated failures.
+
+    After threshold consecutive failures the breaker opens and every call fails
+    fast for a cool-down that doubles (with jitter) each time it trips. When the
+    cool-down ends one probe call is let through: success closes the breaker,
+    failure opens it again.
+    """
+
+    def __init__(self, host, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.last_error = None
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may go ahead, False while the breaker is open"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() >= self._open_until:
+                # Let exactly one probe through, everyone else keeps failing fast
+                self.state = "half-open"
+                return True
+            return False
+
+    def retry_in(self):
+        return max(0.0, self._open_until - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trips = 0
+            self.last_error = None
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if self.state == "half-open" or self.failures >= self.threshold:
+                self.trips += 1
+                self.state = "open"
+                self._open_until = time.monotonic() + backoff_delay(self.trips, *self.cooldown)
+
+    def status(self):
+        """Snapshot of the breaker for display"""
+        return {
+            "host": self.host,
+            "state": self.state,
+            "failures": self.failures,
+            "retry_in": self.retry_in() if self.state == "open" else 0.0,
+            "last_error": self.last_error,
+        }
+
+
+_circuit_breakers = {}
+
+
+def get_circuit_breaker(host):
+    """Return the process-wide circuit breaker for an upstream host"""
+    with _rate_limiters_guard:
+        if host not in _circuit_breakers:
+            _circuit_breakers[host] = CircuitBreaker(host)
+        return _circuit_breakers[host]
+
+
+def circuit_breaker_states():
+    """Status of every upstream host that has been called so far"""
+    with _rate_limiters_guard:
+        breakers = list(_circuit_breakers.values())
+    return [breaker.status() for breaker in breakers]
+
+
+def call_upstream(host, limiter, fn, *args, **kwargs):
+    """Call fn against host through limiter (None for no limit) and host's circuit breaker.
+
+    Nothing here sleeps: without a token RateLimitedError is raised straight away,
+    so a page can say when to retry. Background jobs wait it out with
+    call_when_allowed.
+    """
+    # The budget is checked first so a half-open breaker's one probe isn't spent on a call that never happens
+    if limiter is not None:
+        # Background work leaves a token for the next page request instead of draining the bucket
+        retry_in = limiter.try_acquire(keep=1 if getattr(_background_calls, "active", False) else 0)
+        if retry_in > 0:
+            raise RateLimitedError(host, retry_in)
+    breaker = get_circuit_breaker(host)
+    if not breaker.allow():
+        raise CircuitOpenError(host, breaker.retry_in())
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        breaker.record_failure(e)
+        raise
+    breaker.record_success()
+    return result
+
+
+_background_calls = threading.local()
+
+
+def call_when_allowed(fn, *args, attempts=3, **kwargs):
+    """Run fn, sleeping out rate limits between attempts. Only for threads nobody is waiting on.
+
+    Upstream calls made inside only take a token when one more is left over,
+    so background work never starves a page of its next request.
+    """
+    outer = getattr(_background_calls, "active", False)
+    _background_calls.active = True
+    try:
+        for attempt in range(1, attempts + 1):
+            try:
+                return fn(*args, **kwargs)
+            except RateLimitedError as e:
+                if attempt == attempts:
+                    raise
+                time.sleep(e.retry_in)
+    finally:
+        _background_calls.active = outer
+
+
+# =============================================================================
+# HEDGED REQUESTS
+# =============================================================================
+
+HEDGE_DELAY = (0.1, 2.0)  # seconds: bounds on waiting for the preferred provider before asking the next
+STATS_DECAY = 0.2  # weight of the newest observation in the running latency and error averages
+
+
+class ProviderStats:
+    """Running latency and error rate of interchangeable providers.
+
+    Averages decay exponentially so a provider that slows down or starts
+    failing drops down the order within a few calls, and recovers as quickly.
+    Until a provider has answered once it is assumed to take prior_latency.
+    """
+
+    def __init__(self, decay=STATS_DECAY, prior_latency=HEDGE_DELAY[1]):
+        self.decay = decay
+        self.prior_latency = prior_latency
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider, latency, ok):
+        with self._lock:
+            stats = self._stats.setdefault(provider, {
+                'latency': None, 'error_rate': 0.0 if ok else 1.0, 'successes': 0, 'failures': 0
+            })
+            if ok:
+                # Failures often end in a timeout, so only successes say how fast a provider answers
+                if stats['latency'] is None:
+                    stats['latency'] = latency
+                stats['latency'] += self.decay * (latency - stats['latency'])
+                stats['successes'] += 1
+            else:
+                stats['failures'] += 1
+            stats['error_rate'] += self.decay * ((0.0 if ok else 1.0) - stats['error_rate'])
+
+    def ranked(self, providers):
+        """Providers ordered by expected time to a good answer, ties keep their given order"""
+        with self._lock:
+            def expected_wait(provider):
+                stats = self._stats.get(provider)
+                if stats is None:
+                    return self.prior_latency
+                latency = self.prior_latency if stats['latency'] is None else stats['latency']
+                return latency / max(1.0 - stats['error_rate'], 0.05)
+            return sorted(providers, key=expected_wait)
+
+    def hedge_delay(self, provider):
+        """How long to wait on provider before also asking the next one"""
+        with self._lock:
+            stats = self._stats.get(provider)
+        if stats is None or stats['latency'] is None:
+            return HEDGE_DELAY[0]
+        return min(max(2 * stats['latency'], HEDGE_DELAY[0]), HEDGE_DELAY[1])
+
+    def status(self):
+        with self._lock:
+            return [{'provider': provider, **stats} for provider, stats in self._stats.items()]
+
+
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedged-request")
+
+
+def hedged_call(providers, fn, stats, timeout=None):
+    """Return the first usable fn(provider) result, asking providers in parallel.
+
+    The provider expected to answer fastest goes first. The next one is asked
+    as soon as the previous fails, or when it is slower than usual (see
+    ProviderStats.hedge_delay), so a stalled provider costs one hedge delay
+    instead of a full timeout. The first result that isn't None wins. Calls
+    still running are abandoned: they are cancelled if not yet started,
+    otherwise left to finish in the background and counted in the stats.
+    """
+    def timed(provider):
+        started = time.monotonic()
+        try:
+            result = fn(provider)
+        except RequestRejected:
+            raise  # Refused by our own limiter or breaker, the provider wasn't asked
+        except Exception:
+            stats.record(provider, time.monotonic() - started, ok=False)
+            raise
+        stats.record(provider, time.monotonic() - started, ok=result is not None)
+        return result
+
+    queue = stats.ranked(providers)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    running, errors = {}, []
+    try:
+        while queue or running:
+            if queue and not running:
+                provider = queue.pop(0)
+                running[_hedge_executor.submit(timed, provider)] = provider
+            wait_for = stats.hedge_delay(provider) if queue else None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+                wait_for = remaining if wait_for is None else min(wait_for, remaining)
+            done, _ = wait(running, timeout=wait_for, return_when=FIRST_COMPLETED)
+            if not done:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                # The latest provider is slow: hedge with the next one, keep waiting on both
+                provider = queue.pop(0)
+                running[_hedge_executor.submit(timed, provider)] = provider
+                continue
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(f"{name}: {e}")
+                    continue
+                if result is not None:
+                    return result
+                errors.append(f"{name}: no data")
+    finally:
+        for future in running:
+            future.cancel()
+    raise UpstreamError("No provider answered: " + ("; ".join(errors) or "timed out"))
+
+
+# =============================================================================
+# STALE-WHILE-REVALIDATE AND BACKGROUND WARM-UP
+# =============================================================================
+
+# Small shared pool for refreshes nobody is waiting on
+_background_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="market-data-refresh")
+_background_keys = set()
+_background_guard = threading.Lock()
+
+
+def refresh_in_background(key, fn, *args, **kwargs):
+    """Run fn on the background pool unless a refresh for key is already queued or running"""
+    with _background_guard:
+        if key in _background_keys:
+            return
+        _background_keys.add(key)
+
+    def run():
+        try:
+            call_when_allowed(coalesce, key, fn, *args, **kwargs)
+        except Exception:
+            logger.exception("Background refresh of %s failed", key)
+        finally:
+            with _background_guard:
+                _background_keys.discard(key)
+
+    _background_executor.submit(run)
+
+
+class StaleWhileRevalidateCache:
+    """In-process cache that keeps serving expired values while they are refreshed.
+
+    Values younger than ttl are returned as-is. Older values are still returned
+    immediately (up to max_stale) and a background refresh replaces them. Only
+    a missing or very old value makes the caller wait for the upstream call.
+    Failed loads are retried with backoff and never replace a good value, so an
+    outage keeps serving the last good data.
+    """
+
+    def __init__(self, name, ttl, max_stale):
+        self.name = name
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._backoff = FailureBackoff()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        with self._lock:
+            entry = self._entries.get(key)
+        failure = self._backoff.pending(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < self.ttl:
+                return value
+            if failure is not None:
+                # Upstream is failing, keep serving the last good value until it recovers
+                return value
+            if age < self.max_stale:
+                refresh_in_background((self.name, key), self.refresh, key, load)
+                return value
+        elif failure is not None:
+            raise failure
+        return coalesce((self.name, key), self.refresh, key, load)
+
+    def prime(self, key, value, stored_at):
+        """Seed key with a value loaded at stored_at (e.g. from disk) unless a value is already held"""
+        with self._lock:
+            self._entries.setdefault(key, (value, stored_at))
+
+    def refresh(self, key, load):
+        """Load a fresh value for key; failures keep whatever was cached before"""
+        try:
+            value = load()
+            if value is None:
+                raise UpstreamError(f"No {self.name} data for {key}")
+        except Exception as e:
+            self._backoff.record_failure(key, e)
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                raise
+            return entry[0]
+        self._backoff.record_success(key)
+        with self._lock:
+            self._entries[key] = (value, time.time())
+        return value
+
+
+# Company fundamentals barely move, rate tables are refreshed every 10 minutes
+company_info_cache = StaleWhileRevalidateCache("info", ttl=86400, max_stale=7 * 86400)
+rate_table_cache = StaleWhileRevalidateCache("fx", ttl=600, max_stale=86400)
+
+# Which FX provider answers fastest, so it is asked first
+fx_provider_stats = ProviderStats()
+
+# Price history lives in the OHLCV store, this only remembers tickers that failed to sync
+history_backoff = FailureBackoff()
+
+
+class LiveBarFeed:
+    """Intraday bars per ticker shared by every session watching it.
+
+    Each ticker is polled at most once per poll_interval no matter how many
+    sessions ask, and each poll only downloads bars from the newest one held
+    (which is re-fetched because it is usually still forming).
+    """
+
+    def __init__(self, poll_interval=15, max_bars=2000):
+        self.poll_interval = poll_interval
+        self.max_bars = max_bars
+        self._feeds = {}
+        self._lock = threading.Lock()
+
+    def bars(self, ticker, fetch_bars):
+        """Current bars for ticker; fetch_bars(ticker, start) downloads bars from start, or today's if None"""
+        with self._lock:
+            entry = self._feeds.get(ticker)
+        if entry is None or time.time() - entry[1] >= self.poll_interval:
+            return coalesce(("live", ticker), self._poll, ticker, fetch_bars)
+        return entry[0]
+
+    def _poll(self, ticker, fetch_bars):
+        with self._lock:
+            entry = self._feeds.get(ticker)
+        if entry is not None and time.time() - entry[1] < self.poll_interval:
+            return entry[0]  # Another session polled while we were waiting
+
+        held = entry[0] if entry is not None else None
+        try:
+            new = fetch_bars(ticker, held.index[-1] if held is not None and not held.empty else None)
+        except Exception:
+            if held is None:
+                raise
+            new = None  # Keep showing what we have, the circuit breaker decides when to retry
+
+        bars = held
+        if new is not None and not new.empty:
+            bars = new if held is None or held.empty else pd.concat([held[held.index < new.index[0]], new])
+            bars = bars.iloc[-self.max_bars:]
+        elif bars is None:
+            bars = new
+        with self._lock:
+            self._feeds[ticker] = (bars, time.time())
+        return bars
+
+
+live_bar_feed = LiveBarFeed()
+
+
+class BackgroundRefresher:
+    """Daemon thread that keeps popular cache entries warm on an interval.
+
+    Jobs only run while the app is in use: once nobody has called keep_alive()
+    for idle_timeout seconds the refresher stops calling upstream APIs.
+    """
+
+    def __init__(self, interval=240, idle_timeout=1800):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self._jobs = {}
+        self._last_used = time.time()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, name, job):
+        """Add or replace a warm-up job and make sure the refresher is running"""
+        with self._lock:
+            self._jobs[name] = job
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="market-data-warmup", daemon=True)
+                self._thread.start()
+
+    def keep_alive(self):
+        """Note that someone is using the app, so warm-up should continue"""
+        self._last_used = time.time()
+
+    def _run(self):
+        while True:
+            if time.time() - self._last_used < self.idle_timeout:
+                with self._lock:
+                    jobs = list(self._jobs.items())
+                for name, job in jobs:
+                    try:
+                        call_when_allowed(job)
+                    except Exception:
+                        logger.exception("Warm-up job %s failed", name)
+            time.sleep(self.interval)
+
+
+_background_refresher = BackgroundRefresher()
+
+
+def get_background_refresher():
+    """Return the process-wide warm-up refresher"""
+    return _background_refresher
+
+
+# =============================================================================
+# CURRENCY CROSS RATES
+# =============================================================================
+
+# The one rate table that is downloaded; every other pair is triangulated through it
+FX_BASE = "USD"
+
+# Last good rate tables, kept next to the price histories
+FX_SNAPSHOT_DIR = os.path.join(DATA_DIR, "fx")
+
+
+class CrossRates:
+    """Exchange rates between every pair of currencies in one table quoted against a single base.
+
+    matrix[i, j] is the units of currencies[j] one unit of currencies[i] buys,
+    built once per table, so any conversion is a lookup. as_of is when the
+    table was fetched (epoch seconds).
+    """
+
+    def __init__(self, base, rates, as_of=None):
+        quotes = {currency: float(rate) for currency, rate in rates.items() if rate and float(rate) > 0}
+        quotes[base] = 1.0
+        self.base = base
+        self.as_of = time.time() if as_of is None else as_of
+        self.currencies = sorted(quotes)
+        self._index = {currency: i for i, currency in enumerate(self.currencies)}
+        self.quotes = np.array([quotes[currency] for currency in self.currencies])
+        # base -> j divided by base -> i is i -> j
+        self.matrix = self.quotes[None, :] / self.quotes[:, None]
+        self.matrix.flags.writeable = False
+
+    def rate(self, base, target):
+        """Units of target per unit of base, or None if either currency isn't quoted"""
+        i, j = self._index.get(base), self._index.get(target)
+        if i is None or j is None:
+            return None
+        return float(self.matrix[i, j])
+
+    def table(self, currencies):
+        """DataFrame of cross rates among the given currencies that are quoted"""
+        quoted = [currency for currency in currencies if currency in self._index]
+        rows = [self._index[currency] for currency in quoted]
+        return pd.DataFrame(self.matrix[np.ix_(rows, rows)], index=quoted, columns=quoted)
+
+
+class FXSnapshotStore:
+    """Newest good rate table per base currency, persisted as small JSON files.
+
+    Each file (<BASE>.json) holds the fetch time plus parallel lists of
+    currencies and quotes. Every snapshot is read into memory when the store
+    is created, so an outage is answered without touching the disk.
+    """
+
+    def __init__(self, root=FX_SNAPSHOT_DIR):
+        self.root = root
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        try:
+            names = os.listdir(root)
+        except OSError:
+            names = []
+        for name in names:
+            if name.endswith(".json"):
+                snapshot = self._read(os.path.join(root, name))
+                if snapshot is not None:
+                    self._snapshots[snapshot.base] = snapshot
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            return CrossRates(data["base"], dict(zip(data["currencies"], data["quotes"])), as_of=data["fetched_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def latest(self, base):
+        """The newest saved rates for base, or None if it was never fetched"""
+        with self._lock:
+            return self._snapshots.get(base)
+
+    def save(self, cross_rates):
+        """Keep cross_rates as the newest snapshot of its base, in memory and on disk"""
+        with self._lock:
+            current = self._snapshots.get(cross_rates.base)
+            if current is not None and current.as_of >= cross_rates.as_of:
+                return
+            self._snapshots[cross_rates.base] = cross_rates
+        path = os.path.join(self.root, f"{cross_rates.base}.json")
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({
+                    "base": cross_rates.base,
+                    "fetched_at": cross_rates.as_of,
+                    "currencies": cross_rates.currencies,
+                    "quotes": cross_rates.quotes.tolist(),
+                }, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.warning("Could not save the %s rate snapshot", cross_rates.base, exc_info=True)
+
+
+_fx_snapshot_store = None
+_fx_snapshot_store_guard = threading.Lock()
+
+
+def get_fx_snapshot_store():
+    """Return the process-wide FX snapshot store, loading saved snapshots on first use"""
+    global _fx_snapshot_store
+    with _fx_snapshot_store_guard:
+        if _fx_snapshot_store is None:
+            _fx_snapshot_store = FXSnapshotStore()
+        return _fx_snapshot_store
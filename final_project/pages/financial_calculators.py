@@ -1,58 +1,224 @@
-import yfinance as yf
 import streamlit as st
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
 import plotly.express as px
-import requests
+from plotly.subplots import make_subplots
 import numpy as np
 import pandas as pd
 from dateutil.relativedelta import relativedelta
 import time
+from market_data import (
+    get_ohlcv_store, is_valid_symbol, sync_ticker_history, sync_ticker_histories, slice_period, coalesce,
+    refresh_in_background, company_info_cache, rate_table_cache, FX_BASE, CrossRates, get_fx_snapshot_store,
+    get_background_refresher,
+    call_upstream, call_when_allowed, hedged_call, fx_provider_stats, history_backoff, circuit_breaker_states, live_bar_feed,
+    UpstreamError, RequestRejected, CircuitOpenError, RateLimitedError
+)
+from data_sources import get_data_source, FX_PROVIDERS
+import analytics
 
 # =============================================================================
 # RATE LIMITING AND CACHING
 # =============================================================================
 
-# Global variables for rate limiting
-last_request_time = 0
-REQUEST_DELAY = 2  # seconds between requests
-
-def rate_limited_request():
-    """Ensure we don't make requests too frequently"""
-    global last_request_time
-    current_time = time.time()
-    time_since_last = current_time - last_request_time
-    
-    if time_since_last < REQUEST_DELAY:
-        time.sleep(REQUEST_DELAY - time_since_last)
-    
-    last_request_time = time.time()
-
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def cached_fetch_stock_data(ticker, period):
-    """Cached version of stock data fetching"""
+# Every upstream call goes through call_upstream, which applies the data source's
+# rate limiter for the provider and stops calling a host while its circuit breaker
+# is open. Neither ever sleeps in the script thread: they raise an error saying when
+# to retry. Where the data comes from (live APIs or recorded fixtures) is decided by
+# the data source.
+
+def fetch_price_history(ticker, start=None):
+    """Download daily bars: full history, or only from start onwards"""
+    source = get_data_source()
+    return call_upstream(source.host("yfinance"), source.limiter("yfinance"), source.price_history, ticker, start)
+
+def fetch_price_histories(tickers, start=None):
+    """Download daily bars for several tickers in one batched request"""
+    source = get_data_source()
+    return call_upstream(source.host("yfinance"), source.limiter("yfinance"), source.price_histories, tickers, start)
+
+def fetch_intraday_bars(ticker, start=None):
+    """Download today's intraday bars, or only those from start onwards"""
+    source = get_data_source()
+    return call_upstream(source.host("yfinance"), source.limiter("yfinance"), source.intraday_bars, ticker, LIVE_BAR_INTERVAL, start)
+
+def fetch_stock_info(ticker):
+    """Download the company info payload"""
+    source = get_data_source()
+    return call_upstream(source.host("yfinance"), source.limiter("yfinance"), source.company_info, ticker)
+
+# Fundamentals used by the overview and company details panels. Quote fields such as
+# currentPrice, previousClose and volume are read from the price history instead,
+# so they stay fresh while these are cached for a day.
+COMPANY_INFO_FIELDS = [
+    'longName', 'sector', 'industry', 'marketCap', 'trailingPE', 'forwardPE',
+    'dividendYield', 'fiftyTwoWeekHigh', 'fiftyTwoWeekLow', 'beta', 'trailingEps',
+    'returnOnEquity', 'profitMargins', 'fullTimeEmployees'
+]
+
+# Stored price history older than this is refreshed in the background
+HISTORY_MAX_AGE = 300
+
+def load_company_info(ticker):
+    """Download Ticker.info and keep only the fields the app displays"""
+    info = fetch_stock_info(ticker)
+    return {key: info[key] for key in COMPANY_INFO_FIELDS if info.get(key) is not None}
+
+@st.cache_data(ttl=600)  # Cache for 10 minutes, the shared cache underneath keeps it for a day
+def cached_fetch_company_info(ticker):
+    """Cached compact subset of Ticker.info"""
+    return company_info_cache.get(ticker, lambda: load_company_info(ticker))
+
+def sync_price_histories(tickers):
+    """Make sure tickers are in the local store, refreshing stale ones in the background.
+
+    Only tickers that were never stored make the caller wait for yfinance; stale
+    ones are served from disk right away while one batched download updates them.
+    Tickers that failed recently are not retried until their backoff runs out.
+    """
+    store = get_ohlcv_store()
+    ages = {ticker: store.age(ticker) for ticker in tickers if history_backoff.pending(ticker) is None}
+    missing = tuple(ticker for ticker, age in ages.items() if age is None)
+    stale = tuple(ticker for ticker, age in ages.items() if age is not None and age > HISTORY_MAX_AGE)
+    
+    # Concurrent sessions asking for the same tickers share one upstream call
+    if missing:
+        try:
+            coalesce(("history", missing), sync_tracked_histories, store, missing)
+        except RequestRejected:
+            raise  # Not a failure of the tickers, the page tells the user when to retry
+        except Exception:
+            pass  # Recorded in history_backoff, callers report it for the tickers they need
+    if stale:
+        refresh_in_background(("history", stale), sync_tracked_histories, store, stale)
+    return store
+
+def sync_tracked_histories(store, tickers):
+    """Sync tickers into the store and record which ones failed for the backoff"""
     try:
-        rate_limited_request()  # Add rate limiting
-        stock = yf.Ticker(ticker)
-        info = stock.info
-        hist = stock.history(period=period)
-        
-        if hist.empty:
-            return None
-            
-        return hist, info
-            
+        if len(tickers) == 1:
+            sync_ticker_history(store, tickers[0], fetch_price_history, HISTORY_MAX_AGE)
+        else:
+            sync_ticker_histories(store, tickers, fetch_price_histories, HISTORY_MAX_AGE)
     except Exception as e:
-        if "Too Many Requests" in str(e):
-            st.error("🚫 Rate limit exceeded. Please wait 1-2 minutes.")
+        for ticker in tickers:
+            history_backoff.record_failure(ticker, e)
+        raise
+    
+    for ticker in tickers:
+        if store.age(ticker) is None:
+            history_backoff.record_failure(ticker, UpstreamError(f"No price data found for {ticker}"))
         else:
-            st.error(f"Error fetching data: {str(e)}")
-        return None
-
-@st.cache_data(ttl=600)  # Cache exchange rates for 10 minutes
-def cached_get_exchange_rate(base_currency, target_currency):
-    """Cached version of exchange rate fetching"""
-    return get_exchange_rate_impl(base_currency, target_currency)
+            history_backoff.record_success(ticker)
+
+# Failures raise instead of returning None, st.cache_data doesn't cache exceptions
+# so the next rerun tries again (subject to the backoff) rather than reusing the failure
+
+@st.cache_data(ttl=60)  # Cache for 1 minute, the local store underneath is refreshed every 5
+def cached_fetch_price_history(ticker):
+    """Cached full daily history for a ticker, every period is sliced from it"""
+    # Price history comes from the local store, which only downloads bars it doesn't have yet
+    hist = sync_price_histories((ticker,)).load(ticker)
+    if hist is None or hist.empty:
+        raise history_backoff.pending(ticker) or UpstreamError(f"No price data found for {ticker}")
+    return hist
+
+@st.cache_data(ttl=60)  # Cache for 1 minute, the local store underneath is refreshed every 5
+def cached_fetch_price_histories(tickers):
+    """Cached full daily histories for several tickers, synced with one batched download"""
+    store = sync_price_histories(tickers)
+    histories = {ticker: store.load(ticker) for ticker in tickers}
+    histories = {ticker: hist for ticker, hist in histories.items() if hist is not None and not hist.empty}
+    if not histories:
+        raise history_backoff.pending(tickers[0]) or UpstreamError("No price data found")
+    return histories
+
+def load_period_history(ticker, period):
+    """Cached daily bars for the period, without the company info request"""
+    hist = slice_period(cached_fetch_price_history(ticker), period)
+    if hist is None or hist.empty:
+        raise UpstreamError(f"No price data for {ticker} in the selected period")
+    return hist
+
+# Not cached itself: both parts come from their own caches, and a fundamentals
+# failure must not be remembered as an empty info dict for the next minute
+def cached_fetch_stock_data(ticker, period):
+    """Price bars for the period plus company info, each from its own cache"""
+    hist = load_period_history(ticker, period)
+    
+    try:
+        info = cached_fetch_company_info(ticker)
+    except Exception:
+        info = {}  # Fundamentals are optional, the chart and overview work from the bars alone
+    
+    return hist, info
+
+def display_fetch_error(e, subject):
+    """Explain why market data couldn't be loaded"""
+    if isinstance(e, RateLimitedError):
+        st.warning(f"⏳ Too many requests to {e.host} right now. Try again in about {max(e.retry_in, 1):.0f} seconds.")
+    elif isinstance(e, CircuitOpenError):
+        st.error(f"🚫 {e.host} is rate-limiting or unavailable. Retrying automatically in about {e.retry_in:.0f} seconds.")
+    elif "Too Many Requests" in str(e) or "Rate limit" in str(e):
+        st.error("🚫 Rate limit exceeded. Please wait 1-2 minutes.")
+    else:
+        st.error(f"Unable to fetch data for {subject}: {str(e)}")
+
+def parse_symbols(text):
+    """Upper-cased symbols from comma separated input; invalid ones are reported and left out"""
+    symbols = [s.strip().upper() for s in text.split(",") if s.strip()]
+    invalid = [s for s in symbols if not is_valid_symbol(s)]
+    if invalid:
+        st.error(f"Not a valid ticker symbol: {', '.join(invalid)}. Use letters, digits and . - ^ = only.")
+    return [s for s in symbols if is_valid_symbol(s)]
+
+def parse_symbol(text):
+    """Single upper-cased symbol from a text input, or "" if it isn't valid"""
+    symbol = text.strip().upper()
+    if symbol and not is_valid_symbol(symbol):
+        st.error(f"Not a valid ticker symbol: {symbol}. Use letters, digits and . - ^ = only.")
+        return ""
+    return symbol
+
+def display_provider_status():
+    """Warn about upstream providers whose circuit breaker is not closed"""
+    for status in circuit_breaker_states():
+        if status['state'] == 'open':
+            st.warning(
+                f"⚠️ {status['host']} is paused after repeated errors, showing the last data we have. "
+                f"Next attempt in {status['retry_in']:.0f}s."
+            )
+        elif status['state'] == 'half-open':
+            st.info(f"🔄 Checking whether {status['host']} has recovered...")
+
+def start_market_data_warmup():
+    """Keep popular tickers and currency tables warm while the app is in use"""
+    refresher = get_background_refresher()
+    store = get_ohlcv_store()
+    
+    def warm_popular_stocks():
+        # One batched download for the popular tickers whose history has outlived its TTL
+        sync_ticker_histories(store, POPULAR_STOCKS, fetch_price_histories, max_age=HISTORY_MAX_AGE)
+        # Fundamentals are one request per ticker: each one waits for its own token
+        for ticker in POPULAR_STOCKS:
+            try:
+                call_when_allowed(company_info_cache.get, ticker, lambda t=ticker: load_company_info(t))
+            except Exception:
+                pass  # Kept in the cache's backoff, one bad ticker doesn't stop the others
+    
+    # Serve the last saved rates straight away; they are revalidated in the background once stale
+    snapshot = get_fx_snapshot_store().latest(FX_BASE)
+    if snapshot is not None:
+        rate_table_cache.prime(FX_BASE, snapshot, snapshot.as_of)
+    
+    def warm_rate_table():
+        # Every currency pair is derived from this one table; it is only refetched once older than the cache TTL
+        rate_table_cache.get(FX_BASE, fetch_cross_rates)
+    
+    refresher.register("popular_stocks", warm_popular_stocks)
+    refresher.register("rate_table", warm_rate_table)
+    # Every rerun counts as activity; warm-up pauses once the app has been idle for a while
+    refresher.keep_alive()
 
 # =============================================================================
 # MAIN APP FUNCTION
@@ -62,24 +228,29 @@ def show_financial_calculators():
     """Main function to display the financial calculators dashboard"""
     setup_page_config()
     load_custom_css()
+    start_market_data_warmup()
     
     st.title("📈 Advanced Financial Calculators & Market Data")
     
     # Create tabs for different calculators
-    tab1, tab2, tab3, tab4, tab5 = st.tabs([
-        "📊 Stock Analysis", "💰 Investment Calculator", "💱 Currency Converter", 
-        "🏠 Mortgage Calculator", "🎯 Retirement Planner"
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
+        "📊 Stock Analysis", "🧪 Backtesting", "📐 Portfolio", "💰 Investment Calculator",
+        "💱 Currency Converter", "🏠 Mortgage Calculator", "🎯 Retirement Planner"
     ])
     
     with tab1:
         show_stock_analysis()
     with tab2:
-        show_investment_calculator()
+        show_backtester()
     with tab3:
-        show_currency_converter()
+        show_portfolio_analyzer()
     with tab4:
-        show_mortgage_calculator()
+        show_investment_calculator()
     with tab5:
+        show_currency_converter()
+    with tab6:
+        show_mortgage_calculator()
+    with tab7:
         show_retirement_planner()
 
 # =============================================================================
@@ -133,9 +304,17 @@ def show_stock_analysis():
     # Add warning about rate limits
     st.warning("""
     ⚠️ **Note:** Stock data is rate-limited. If you see errors, please wait a few moments before trying again.
-    Data is cached for 5 minutes to reduce API calls.
+    Data is cached for 5 minutes to reduce API calls, and the last good data is shown while a provider is failing.
     """)
     
+    mode = st.radio("Analysis Mode", ["Single Stock", "Compare Stocks", "Live Quotes"], horizontal=True)
+    if mode == "Compare Stocks":
+        show_stock_comparison()
+        return
+    if mode == "Live Quotes":
+        show_live_quotes()
+        return
+    
     col1, col2 = st.columns([1, 2])
     
     with col1:
@@ -153,7 +332,7 @@ def get_stock_inputs():
     if 'selected_stock' not in st.session_state:
         st.session_state.selected_stock = "AAPL"
     
-    ticker = st.text_input("Enter stock symbol (e.g., AAPL, TSLA, GOOGL):", st.session_state.selected_stock).upper()
+    ticker = parse_symbol(st.text_input("Enter stock symbol (e.g., AAPL, TSLA, GOOGL):", st.session_state.selected_stock))
     
     period = st.selectbox(
         "Time Period:",
@@ -167,6 +346,9 @@ def get_stock_inputs():
     show_rsi = st.checkbox("RSI", value=True)
     show_volume = st.checkbox("Volume", value=True)
     show_macd = st.checkbox("MACD", value=False)
+    show_bollinger = st.checkbox("Bollinger Bands", value=False)
+    show_atr = st.checkbox("ATR", value=False)
+    show_obv = st.checkbox("OBV", value=False)
     
     # Quick stock buttons
     display_quick_stock_buttons()
@@ -175,54 +357,147 @@ def get_stock_inputs():
         'show_ma': show_ma,
         'show_rsi': show_rsi, 
         'show_volume': show_volume,
-        'show_macd': show_macd
+        'show_macd': show_macd,
+        'show_bollinger': show_bollinger,
+        'show_atr': show_atr,
+        'show_obv': show_obv
     }
 
+POPULAR_STOCKS = ["AAPL", "TSLA", "GOOGL", "MSFT", "AMZN", "NVDA", "META", "BRK-B"]
+
 def display_quick_stock_buttons():
     """Display quick selection buttons for popular stocks"""
     st.markdown("---")
     st.markdown("**💡 Popular Stocks:**")
-    popular_stocks = ["AAPL", "TSLA", "GOOGL", "MSFT", "AMZN", "NVDA", "META", "BRK-B"]
     cols = st.columns(4)
     
-    for idx, stock in enumerate(popular_stocks):
+    for idx, stock in enumerate(POPULAR_STOCKS):
         with cols[idx % 4]:
             if st.button(stock, key=f"stock_{stock}"):
                 st.session_state.selected_stock = stock
                 st.rerun()
 
+def show_stock_comparison():
+    """Compare several stocks fetched together in one batched download"""
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        st.subheader("Stocks to Compare")
+        selected = st.multiselect("Popular stocks:", POPULAR_STOCKS, default=POPULAR_STOCKS[:4])
+        extra = parse_symbols(st.text_input("More symbols (comma separated):", ""))
+        period = st.selectbox(
+            "Time Period:",
+            ["1mo", "3mo", "6mo", "1y", "2y", "5y", "max"],
+            index=3, key="compare_period"
+        )
+    
+    tickers = tuple(sorted(set(selected) | set(extra)))
+    
+    with col2:
+        if len(tickers) < 2:
+            st.info("Pick at least two stocks to compare.")
+            return
+        
+        display_provider_status()
+        try:
+            histories = cached_fetch_price_histories(tickers)
+        except Exception as e:
+            display_fetch_error(e, ", ".join(tickers))
+            return
+        missing = [ticker for ticker in tickers if ticker not in histories]
+        if missing:
+            st.warning(f"No data found for: {', '.join(missing)}")
+        if len(histories) < 2:
+            return
+        
+        histories = {ticker: slice_period(hist, period) for ticker, hist in histories.items()}
+        display_relative_performance_chart(histories, period)
+        display_comparison_table(histories)
+
+def display_relative_performance_chart(histories, period):
+    """Display every stock rebased to 100 at the start of the period"""
+    st.subheader("📈 Relative Performance")
+    key = ('relative_performance', period) + tuple(
+        (ticker, hist.index[0].value, hist.index[-1].value, len(hist), float(hist['Close'].iloc[-1]))
+        for ticker, hist in histories.items()
+    )
+    plot_cached_figure(key, lambda: build_relative_performance_chart(histories, period))
+
+def build_relative_performance_chart(histories, period):
+    """Build the normalized relative-performance line chart"""
+    fig = go.Figure()
+    for ticker, hist in histories.items():
+        normalized = hist['Close'].to_numpy() / hist['Close'].iloc[0] * 100
+        add_line(fig, hist, normalized, None, name=ticker)
+    fig.add_hline(y=100, line_dash="dash", line_color="gray")
+    fig.update_layout(
+        title=f"Growth of 100 - {period}",
+        xaxis_title="Date",
+        yaxis_title="Value (start = 100)",
+        height=500
+    )
+    return fig
+
+def display_comparison_table(histories):
+    """Display return and risk metrics for every compared stock"""
+    st.subheader("📋 Comparison Metrics")
+    rows = []
+    for ticker, hist in histories.items():
+        close = hist['Close'].to_numpy()
+        summary = analytics.performance_summary(close)
+        returns = close[1:] / close[:-1] - 1
+        var = analytics.value_at_risk(returns)
+        rows.append({
+            'Symbol': ticker,
+            'Last Price': f"${hist['Close'].iloc[-1]:,.2f}",
+            'Period Return': f"{summary['total_return']*100:+.2f}%",
+            'Annualized Return': f"{summary['annual_return']*100:+.2f}%",
+            'Volatility (ann.)': f"{summary['volatility']*100:.2f}%",
+            'Max Drawdown': f"{summary['max_drawdown']*100:.2f}%",
+            'VaR 95% (1 day)': f"{var['historical_var']*100:.2f}%",
+            'Sortino': f"{analytics.sortino_ratio(returns):.2f}"
+        })
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+
 def analyze_and_display_stock(ticker, period, indicators):
     """Main function to analyze and display stock data"""
+    display_provider_status()
     try:
         # Use cached function with rate limiting
-        stock_data = cached_fetch_stock_data(ticker, period)
-        if not stock_data:
-            st.error(f"Unable to fetch data for {ticker}. Please try again in a few moments.")
-            return
-            
-        hist, info = stock_data
+        hist, info = cached_fetch_stock_data(ticker, period)
+    except Exception as e:
+        display_fetch_error(e, ticker)
+        st.info("💡 Tip: Use the cached data for popular stocks, or try again shortly.")
+        return
+    
+    try:
+        # All indicators are computed once per ticker and bar set, so toggling
+        # a checkbox only changes what gets drawn
+        values = get_stock_indicators(ticker, hist)
         
         # Display all stock information
         display_stock_overview(ticker, info, hist)
-        display_price_chart(ticker, hist, period, indicators['show_ma'])
-        
-        if indicators['show_rsi']:
-            display_rsi_indicator(hist)
-            
-        if indicators['show_macd']:
-            display_macd_indicator(hist)
-            
-        if indicators['show_volume']:
-            display_volume_chart(hist)
-            
-        display_company_details(info)
+        display_risk_panel(ticker, hist, period)
+        display_price_chart(ticker, hist, period, indicators, values)
+        display_company_details(info, hist)
         
     except Exception as e:
-        if "Too Many Requests" in str(e):
-            st.error("🚫 Rate limit exceeded. Please wait 1-2 minutes before making another request.")
-            st.info("💡 Tip: Use the cached data for popular stocks, or try again shortly.")
-        else:
-            st.error(f"Error analyzing {ticker}: {str(e)}")
+        st.error(f"Error analyzing {ticker}: {str(e)}")
+
+def get_stock_indicators(ticker, hist):
+    """Get indicator arrays for the bars in hist, computed over the ticker's full history"""
+    full_hist = cached_fetch_price_history(ticker)
+    
+    # hist is normally a slice of the full history; line it up by timestamp so moving
+    # averages and EWMs are already warmed up at the start of short periods
+    if full_hist is not None and not full_hist.empty:
+        start = full_hist.index.searchsorted(hist.index[0])
+        end = start + len(hist)
+        if end <= len(full_hist) and full_hist.index[end - 1] == hist.index[-1]:
+            values = analytics.get_indicators(ticker, full_hist)
+            return {name: series[start:end] for name, series in values.items()}
+    
+    return analytics.get_indicators(ticker, hist)
 
 def display_stock_overview(ticker, info, hist):
     """Display stock overview and key metrics"""
@@ -247,6 +522,66 @@ def display_stock_overview(ticker, info, hist):
     with col4:
         display_dividend_yield(info)
 
+RISK_BENCHMARK = "SPY"
+
+def display_risk_panel(ticker, hist, period):
+    """Display VaR, CVaR, drawdown, Sortino and rolling risk for the selected period"""
+    st.subheader("⚠️ Risk Metrics")
+    if len(hist) < 30:
+        st.info("Not enough history in this period for risk metrics.")
+        return
+    
+    returns, benchmark_returns = get_risk_returns(ticker, hist)
+    risk = analytics.risk_summary(returns.to_numpy(), benchmark_returns)
+    
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        st.metric("VaR 95% (1 day)", f"{risk['historical_var']*100:.2f}%",
+                  f"{risk['parametric_var']*100:.2f}% normal", delta_color="off")
+    with col2:
+        st.metric("CVaR 95% (1 day)", f"{risk['historical_cvar']*100:.2f}%",
+                  f"{risk['parametric_cvar']*100:.2f}% normal", delta_color="off")
+    with col3:
+        st.metric("Max Drawdown", f"{risk['max_drawdown']*100:.1f}%")
+    with col4:
+        st.metric("Sortino Ratio", f"{risk['sortino']:.2f}")
+    with col5:
+        st.metric(f"Beta vs {RISK_BENCHMARK}", f"{risk['beta']:.2f}" if benchmark_returns is not None else "N/A")
+    
+    if risk['rolling_volatility'] is not None:
+        key = ('risk_chart', ticker, period, returns.index[0].value, returns.index[-1].value,
+               len(returns), float(hist['Close'].iloc[-1]), benchmark_returns is not None)
+        plot_cached_figure(key, lambda: build_risk_chart(ticker, returns.index, risk))
+
+def get_risk_returns(ticker, hist):
+    """Daily returns of the ticker, aligned with the benchmark's when it is available"""
+    close = hist['Close']
+    if ticker != RISK_BENCHMARK:
+        try:
+            benchmark = cached_fetch_price_history(RISK_BENCHMARK)
+            aligned = analytics.return_matrix({ticker: close, RISK_BENCHMARK: benchmark.loc[benchmark.index >= hist.index[0], 'Close']})
+            if len(aligned) >= 30:
+                return aligned[ticker], aligned[RISK_BENCHMARK].to_numpy()
+        except Exception:
+            pass  # Beta is optional, everything else only needs the ticker's own bars
+    return close.pct_change().iloc[1:], None
+
+def build_risk_chart(ticker, dates, risk):
+    """Build the drawdown, rolling volatility and rolling beta panels"""
+    frame = pd.DataFrame(index=dates)
+    rows = 3 if risk['rolling_beta'] is not None else 2
+    titles = ["Drawdown (%)", f"Rolling {analytics.RISK_WINDOW}-Day Volatility (% annualized)",
+              f"Rolling {analytics.RISK_WINDOW}-Day Beta vs {RISK_BENCHMARK}"][:rows]
+    fig = make_subplots(rows=rows, cols=1, shared_xaxes=True, vertical_spacing=0.06, subplot_titles=titles)
+    add_line(fig, frame, risk['drawdown'][1:] * 100, 1, name='Drawdown',
+             line=dict(color='red', width=1), fill='tozeroy')
+    add_line(fig, frame, risk['rolling_volatility'] * 100, 2, name='Volatility', line=dict(color='#667eea', width=1.5))
+    if rows == 3:
+        add_line(fig, frame, risk['rolling_beta'], 3, name='Beta', line=dict(color='orange', width=1.5))
+        fig.add_hline(y=1, line_dash="dash", line_color="gray", row=3, col=1)
+    fig.update_layout(height=180 * rows + 100, showlegend=False, title=f"{ticker} Risk Over Time")
+    return fig
+
 def get_current_price(info, hist):
     """Extract current price from stock data"""
     return info.get('currentPrice', 
@@ -297,118 +632,144 @@ def display_dividend_yield(info):
     else:
         st.metric("Dividend Yield", "0%")
 
-def display_price_chart(ticker, hist, period, show_ma):
-    """Display the main price chart with optional moving averages"""
+def plot_cached_figure(key, build_figure):
+    """Display a Plotly figure, rebuilding it only when its inputs changed"""
+    fig = analytics.cached_figure(key, build_figure)
+    st.plotly_chart(fig, use_container_width=True)
+
+def display_price_chart(ticker, hist, period, indicators, values):
+    """Display price, volume and indicator panels in one figure sharing the date axis"""
     st.subheader("📈 Advanced Price Chart")
-    fig = go.Figure()
+    
+    key = (
+        'stock_chart', ticker, period, hist.index[0].value, hist.index[-1].value,
+        len(hist), float(hist['Close'].iloc[-1]), tuple(sorted(indicators.items()))
+    )
+    plot_cached_figure(key, lambda: build_stock_chart(ticker, hist, period, indicators, values))
+
+def build_stock_chart(ticker, hist, period, indicators, values):
+    """Build the shared-x subplot figure for the selected indicators"""
+    # Long periods are drawn as weekly/monthly candles so the chart payload stays
+    # about the same size however much history the ticker has
+    bars, candle_size = analytics.downsample_ohlcv(hist)
+    title = f"{ticker} Stock Price - {period}"
+    if candle_size != "Daily":
+        title += f" ({candle_size.lower()} candles)"
+    
+    panels = [
+        (name, title) for name, title, shown in [
+            ('volume', "Volume", indicators['show_volume']),
+            ('rsi', "RSI", indicators['show_rsi'] and len(hist) > 14),
+            ('macd', "MACD", indicators['show_macd'] and len(hist) > 26),
+            ('atr', "ATR", indicators['show_atr'] and len(hist) > 14),
+            ('obv', "OBV", indicators['show_obv']),
+        ] if shown
+    ]
+    
+    fig = make_subplots(
+        rows=len(panels) + 1, cols=1, shared_xaxes=True, vertical_spacing=0.03,
+        row_heights=[0.5] + [0.5 / max(len(panels), 1)] * len(panels),
+        subplot_titles=[title] + [panel_title for _, panel_title in panels]
+    )
     
     # Candlestick chart
     fig.add_trace(go.Candlestick(
-        x=hist.index,
-        open=hist['Open'],
-        high=hist['High'],
-        low=hist['Low'],
-        close=hist['Close'],
+        x=bars.index,
+        open=bars['Open'],
+        high=bars['High'],
+        low=bars['Low'],
+        close=bars['Close'],
         name='Price'
-    ))
+    ), row=1, col=1)
     
     # Add moving averages if requested
-    if show_ma and len(hist) > 20:
-        add_moving_averages(fig, hist)
+    if indicators['show_ma'] and len(hist) > 20:
+        add_moving_averages(fig, hist, values)
+    
+    if indicators['show_bollinger'] and len(hist) > 20:
+        add_bollinger_bands(fig, hist, values)
+    
+    panel_builders = {
+        'volume': add_volume_panel,
+        'rsi': add_rsi_panel,
+        'macd': add_macd_panel,
+        'atr': add_atr_panel,
+        'obv': add_obv_panel,
+    }
+    for row, (name, _) in enumerate(panels, start=2):
+        panel_builders[name](fig, row, hist, bars, values)
     
     fig.update_layout(
-        title=f"{ticker} Stock Price - {period}",
-        xaxis_title="Date",
-        yaxis_title="Price ($)",
-        height=500,
-        showlegend=True
+        height=500 + 200 * len(panels),
+        showlegend=True,
+        xaxis_rangeslider_visible=False
     )
-    
-    st.plotly_chart(fig, use_container_width=True)
+    fig.update_yaxes(title_text="Price ($)", row=1, col=1)
+    fig.update_xaxes(title_text="Date", row=len(panels) + 1, col=1)
+    return fig
+
+def add_line(fig, hist, y, row, indices=None, **kwargs):
+    """Add a WebGL line trace, keeping only the points that preserve its shape"""
+    if indices is None:
+        indices = analytics.lttb_indices(hist.index.asi8, y)
+    trace = go.Scattergl(x=hist.index[indices], y=np.asarray(y)[indices], mode='lines', **kwargs)
+    if row is None:
+        fig.add_trace(trace)
+    else:
+        fig.add_trace(trace, row=row, col=1)
 
-def add_moving_averages(fig, hist):
+def add_moving_averages(fig, hist, values):
     """Add moving averages to the price chart"""
-    hist['MA20'] = hist['Close'].rolling(window=20).mean()
-    hist['MA50'] = hist['Close'].rolling(window=50).mean()
-    
-    fig.add_trace(go.Scatter(
-        x=hist.index, y=hist['MA20'],
-        mode='lines', name='MA20',
-        line=dict(color='orange', width=2)
-    ))
-    fig.add_trace(go.Scatter(
-        x=hist.index, y=hist['MA50'],
-        mode='lines', name='MA50',
-        line=dict(color='red', width=2)
-    ))
-
-def display_rsi_indicator(hist):
-    """Display RSI technical indicator"""
-    if len(hist) > 14:
-        st.subheader("📊 Technical Indicators")
-        
-        # Calculate RSI
-        hist['RSI'] = calculate_rsi(hist['Close'])
-        
-        fig_rsi = go.Figure()
-        fig_rsi.add_trace(go.Scatter(
-            x=hist.index, y=hist['RSI'],
-            mode='lines', name='RSI',
-            line=dict(color='purple', width=2)
-        ))
-        fig_rsi.add_hline(y=70, line_dash="dash", line_color="red", annotation_text="Overbought")
-        fig_rsi.add_hline(y=30, line_dash="dash", line_color="green", annotation_text="Oversold")
-        fig_rsi.update_layout(title="Relative Strength Index (RSI)", height=300)
-        st.plotly_chart(fig_rsi, use_container_width=True)
-
-def calculate_rsi(prices, window=14):
-    """Calculate Relative Strength Index"""
-    delta = prices.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=window).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=window).mean()
-    rs = gain / loss
-    return 100 - (100 / (1 + rs))
-
-def display_macd_indicator(hist):
-    """Display MACD technical indicator"""
-    if len(hist) > 26:
-        macd_data = calculate_macd(hist['Close'])
-        
-        fig_macd = go.Figure()
-        fig_macd.add_trace(go.Scatter(x=hist.index, y=macd_data['macd'], name='MACD', line=dict(color='blue')))
-        fig_macd.add_trace(go.Scatter(x=hist.index, y=macd_data['signal'], name='Signal', line=dict(color='red')))
-        fig_macd.add_trace(go.Bar(x=hist.index, y=macd_data['histogram'], name='Histogram', marker_color='gray'))
-        
-        fig_macd.update_layout(title="MACD Indicator", height=300)
-        st.plotly_chart(fig_macd, use_container_width=True)
-
-def calculate_macd(prices, fast=12, slow=26, signal=9):
-    """Calculate MACD indicator"""
-    exp1 = prices.ewm(span=fast).mean()
-    exp2 = prices.ewm(span=slow).mean()
-    macd = exp1 - exp2
-    signal_line = macd.ewm(span=signal).mean()
-    histogram = macd - signal_line
-    
-    return {'macd': macd, 'signal': signal_line, 'histogram': histogram}
-
-def display_volume_chart(hist):
-    """Display trading volume chart"""
-    fig_volume = go.Figure()
-    colors = ['red' if hist['Close'].iloc[i] < hist['Open'].iloc[i] else 'green' 
-             for i in range(len(hist))]
-    
-    fig_volume.add_trace(go.Bar(
-        x=hist.index, y=hist['Volume'],
+    add_line(fig, hist, values['MA20'], 1, name='MA20', line=dict(color='orange', width=2))
+    add_line(fig, hist, values['MA50'], 1, name='MA50', line=dict(color='red', width=2))
+
+def add_bollinger_bands(fig, hist, values):
+    """Add Bollinger Bands to the price chart"""
+    # Both bands use the middle band's points so the fill between them lines up
+    indices = analytics.lttb_indices(hist.index.asi8, values['BB_middle'])
+    add_line(fig, hist, values['BB_upper'], 1, indices, name='BB Upper',
+             line=dict(color='gray', width=1, dash='dot'))
+    add_line(fig, hist, values['BB_lower'], 1, indices, name='BB Lower',
+             line=dict(color='gray', width=1, dash='dot'),
+             fill='tonexty', fillcolor='rgba(128, 128, 128, 0.1)')
+
+def add_volume_panel(fig, row, hist, bars, values):
+    """Add trading volume bars, one per drawn candle"""
+    colors = np.where(bars['Close'] < bars['Open'], 'red', 'green')
+    fig.add_trace(go.Bar(
+        x=bars.index, y=bars['Volume'],
         name='Volume',
         marker_color=colors
-    ))
-    fig_volume.update_layout(title="Trading Volume", height=300)
-    st.plotly_chart(fig_volume, use_container_width=True)
-
-def display_company_details(info):
+    ), row=row, col=1)
+
+def add_rsi_panel(fig, row, hist, bars, values):
+    """Add the RSI line with overbought/oversold levels"""
+    add_line(fig, hist, values['RSI'], row, name='RSI', line=dict(color='purple', width=2))
+    fig.add_hline(y=70, line_dash="dash", line_color="red", annotation_text="Overbought", row=row, col=1)
+    fig.add_hline(y=30, line_dash="dash", line_color="green", annotation_text="Oversold", row=row, col=1)
+
+def add_macd_panel(fig, row, hist, bars, values):
+    """Add MACD, signal line and histogram"""
+    add_line(fig, hist, values['MACD'], row, name='MACD', line=dict(color='blue'))
+    add_line(fig, hist, values['MACD_signal'], row, name='Signal', line=dict(color='red'))
+    indices = analytics.lttb_indices(hist.index.asi8, values['MACD_histogram'])
+    fig.add_trace(go.Bar(
+        x=hist.index[indices], y=values['MACD_histogram'][indices],
+        name='Histogram', marker_color='gray'
+    ), row=row, col=1)
+
+def add_atr_panel(fig, row, hist, bars, values):
+    """Add the Average True Range volatility line"""
+    add_line(fig, hist, values['ATR'], row, name='ATR', line=dict(color='teal', width=2))
+
+def add_obv_panel(fig, row, hist, bars, values):
+    """Add the On-Balance Volume line"""
+    add_line(fig, hist, values['OBV'], row, name='OBV', line=dict(color='darkgreen', width=2))
+
+def display_company_details(info, hist):
     """Display detailed company information"""
     st.subheader("📋 Company Information")
+    volume = f"{int(hist['Volume'].iloc[-1]):,}" if not hist.empty else 'N/A'
     
     col1, col2 = st.columns(2)
     
@@ -418,7 +779,7 @@ def display_company_details(info):
         **Industry:** {info.get('industry', 'N/A')}  
         **52 Week High:** ${info.get('fiftyTwoWeekHigh', 'N/A')}  
         **52 Week Low:** ${info.get('fiftyTwoWeekLow', 'N/A')}  
-        **Volume:** {info.get('volume', 'N/A'):,}
+        **Volume:** {volume}
         **Beta:** {info.get('beta', 'N/A')}
         """)
     
@@ -427,10 +788,449 @@ def display_company_details(info):
         **EPS:** ${info.get('trailingEps', 'N/A')}  
         **ROE:** {info.get('returnOnEquity', 'N/A')}  
         **Profit Margin:** {info.get('profitMargins', 'N/A')}  
-        **Employees:** {info.get('fullTimeEmployees', 'N/A'):,}
+        **Employees:** {f"{info['fullTimeEmployees']:,}" if 'fullTimeEmployees' in info else 'N/A'}
         **Forward P/E:** {info.get('forwardPE', 'N/A')}
         """)
 
+# =============================================================================
+# LIVE QUOTES
+# =============================================================================
+
+LIVE_BAR_INTERVAL = "1m"
+LIVE_MAX_BARS = 390  # One regular trading session of one-minute bars
+LIVE_REFRESH_INTERVALS = {"15 seconds": 15, "30 seconds": 30, "1 minute": 60}
+
+def show_live_quotes():
+    """Follow one ticker's intraday bars, refreshing only the live panel"""
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        st.subheader("Live Quotes")
+        ticker = parse_symbol(st.text_input(
+            "Stock symbol:", st.session_state.get('selected_stock', "AAPL"), key="live_ticker"
+        ))
+        refresh = st.selectbox("Refresh every:", list(LIVE_REFRESH_INTERVALS), key="live_refresh")
+        st.caption("Only the chart and metrics refresh; the rest of the page stays as it is.")
+    
+    with col2:
+        if ticker:
+            # A fragment reruns on its own timer without rerunning the whole page
+            live_panel = st.fragment(run_every=LIVE_REFRESH_INTERVALS[refresh])(display_live_quotes)
+            live_panel(ticker)
+
+def display_live_quotes(ticker):
+    """Live metrics and intraday chart for a ticker"""
+    display_provider_status()
+    try:
+        # Every session watching this ticker shares one poll of the upstream
+        bars = live_bar_feed.bars(ticker, fetch_intraday_bars)
+    except Exception as e:
+        display_fetch_error(e, ticker)
+        return
+    
+    if bars is None or bars.empty:
+        st.info(f"No intraday bars for {ticker} yet. The market may be closed.")
+        return
+    
+    session = bars[bars.index.normalize() == bars.index[-1].normalize()]
+    display_live_metrics(ticker, session)
+    st.plotly_chart(update_live_chart(ticker, session), use_container_width=True, key="live_chart")
+    st.caption(f"Last bar {session.index[-1]:%H:%M} · refreshed {datetime.now():%H:%M:%S}")
+
+def display_live_metrics(ticker, session):
+    """Display last price against the previous close, plus the session range and volume"""
+    last = float(session['Close'].iloc[-1])
+    try:
+        daily = cached_fetch_price_history(ticker)
+        earlier = daily[daily.index.normalize() < session.index[0].normalize()]
+        prev_close = float(earlier['Close'].iloc[-1]) if not earlier.empty else float(session['Open'].iloc[0])
+    except Exception:
+        prev_close = float(session['Open'].iloc[0])
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        display_price_metric(last, prev_close)
+    with col2:
+        st.metric("Day High", f"${session['High'].max():.2f}")
+    with col3:
+        st.metric("Day Low", f"${session['Low'].min():.2f}")
+    with col4:
+        st.metric("Volume", f"{int(session['Volume'].sum()):,}")
+
+def update_live_chart(ticker, session):
+    """Return this session's live figure with the newest bars appended to it.
+
+    The figure is kept in session state, so a refresh only replaces the bar that
+    was still forming and adds the ones after it instead of rebuilding every trace.
+    Streamlit still sends the whole figure on each refresh, which is why it is
+    capped to the last LIVE_MAX_BARS bars.
+    """
+    state = st.session_state.get('live_chart_state')
+    if state is None or state['ticker'] != ticker or state['last_bar'] not in session.index:
+        fig = build_live_chart(ticker, session.iloc[-LIVE_MAX_BARS:])
+        st.session_state.live_chart_state = {'ticker': ticker, 'fig': fig, 'last_bar': session.index[-1]}
+        return fig
+    
+    new = session[session.index >= state['last_bar']]
+    candles, volume = state['fig'].data
+    candles.x = append_live_values(candles.x, new.index)
+    candles.open = append_live_values(candles.open, new['Open'])
+    candles.high = append_live_values(candles.high, new['High'])
+    candles.low = append_live_values(candles.low, new['Low'])
+    candles.close = append_live_values(candles.close, new['Close'])
+    volume.x = append_live_values(volume.x, new.index)
+    volume.y = append_live_values(volume.y, new['Volume'])
+    state['last_bar'] = session.index[-1]
+    return state['fig']
+
+def append_live_values(values, new_values):
+    """Replace the last value (the bar that was still forming) and append the rest, capped to the window"""
+    values = np.concatenate([np.asarray(values, dtype=object)[:-1], np.asarray(new_values, dtype=object)])
+    return values[-LIVE_MAX_BARS:]
+
+def build_live_chart(ticker, bars):
+    """Build the intraday candlestick and volume figure"""
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.03, row_heights=[0.75, 0.25])
+    fig.add_trace(go.Candlestick(
+        x=bars.index, open=bars['Open'], high=bars['High'], low=bars['Low'], close=bars['Close'],
+        name='Price'
+    ), row=1, col=1)
+    fig.add_trace(go.Bar(x=bars.index, y=bars['Volume'], name='Volume', marker_color='rgba(0,100,200,0.5)'), row=2, col=1)
+    fig.update_layout(
+        title=f'{ticker} Intraday ({LIVE_BAR_INTERVAL} bars)', height=550, showlegend=False,
+        xaxis_rangeslider_visible=False, uirevision=ticker
+    )
+    return fig
+
+# =============================================================================
+# BACKTESTING FUNCTIONS
+# =============================================================================
+
+# Strategy label -> (analytics position function, sweep kernel name or None)
+BACKTEST_STRATEGIES = {
+    "MA Crossover": (analytics.ma_crossover_positions, 'ma_crossover'),
+    "RSI 30/70 Reversion": (analytics.rsi_positions, 'rsi'),
+    "MACD Signal Cross": (analytics.macd_positions, None),
+}
+
+def show_backtester():
+    """Display the strategy backtester"""
+    st.header("🧪 Strategy Backtesting")
+    
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        st.subheader("Backtest Setup")
+        ticker = parse_symbol(st.text_input(
+            "Stock symbol:", st.session_state.get('selected_stock', "AAPL"), key="bt_ticker"
+        ))
+        period = st.selectbox("History:", ["1y", "2y", "5y", "max"], index=3, key="bt_period")
+        strategy = st.selectbox("Strategy:", list(BACKTEST_STRATEGIES), key="bt_strategy")
+        params = get_strategy_params(strategy)
+        if 'slow' in params and params['fast'] >= params['slow']:
+            st.error("The fast window must be shorter than the slow window.")
+            return
+        cost_bps = st.number_input("Trading Cost (bps per trade):", min_value=0.0, max_value=100.0, value=5.0, step=1.0, key="bt_cost")
+        
+        grid = None
+        if BACKTEST_STRATEGIES[strategy][1] and st.checkbox("Optimize parameters (grid sweep)", key="bt_sweep"):
+            grid = get_sweep_grid(strategy, params)
+    
+    with col2:
+        if ticker:
+            run_and_display_backtest(ticker, period, strategy, params, cost_bps / 10000, grid)
+
+def get_strategy_params(strategy):
+    """Get the parameter inputs for a strategy"""
+    if strategy == "MA Crossover":
+        fast = st.number_input("Fast MA Window:", min_value=2, max_value=200, value=20, key="bt_fast")
+        slow = st.number_input("Slow MA Window:", min_value=3, max_value=400, value=50, key="bt_slow")
+        return {'fast': int(fast), 'slow': int(slow)}
+    if strategy == "RSI 30/70 Reversion":
+        window = st.number_input("RSI Window:", min_value=2, max_value=50, value=14, key="bt_rsi_window")
+        lower = st.slider("Buy below RSI:", 5, 50, 30, key="bt_rsi_lower")
+        upper = st.slider("Sell above RSI:", 50, 95, 70, key="bt_rsi_upper")
+        return {'window': int(window), 'lower': lower, 'upper': upper}
+    fast = st.number_input("MACD Fast:", min_value=2, max_value=50, value=12, key="bt_macd_fast")
+    slow = st.number_input("MACD Slow:", min_value=3, max_value=100, value=26, key="bt_macd_slow")
+    signal = st.number_input("Signal Line:", min_value=2, max_value=50, value=9, key="bt_macd_signal")
+    return {'fast': int(fast), 'slow': int(slow), 'signal': int(signal)}
+
+def get_sweep_grid(strategy, params):
+    """Get the parameter grid to sweep"""
+    if strategy == "MA Crossover":
+        min_window, max_window = st.slider("MA windows to test:", 2, 250, (5, 200), key="bt_grid_range")
+        step = st.number_input("Window step:", min_value=1, max_value=50, value=5, key="bt_grid_step")
+        return tuple(analytics.ma_crossover_grid(min_window, max_window, int(step)))
+    return tuple(analytics.rsi_grid(params['window']))
+
+def run_and_display_backtest(ticker, period, strategy, params, cost, grid):
+    """Backtest the strategy on the ticker's history and display the results"""
+    try:
+        hist = load_period_history(ticker, period)
+    except Exception as e:
+        display_fetch_error(e, ticker)
+        return
+    
+    close = hist['Close'].to_numpy()
+    positions = BACKTEST_STRATEGIES[strategy][0](close, **params)
+    result = analytics.run_backtest(close, positions, cost)
+    benchmark = analytics.run_backtest(close, np.ones(len(close)), cost)
+    
+    display_backtest_metrics(result, benchmark)
+    
+    st.subheader("📈 Equity Curve")
+    key = (
+        'backtest', ticker, period, strategy, tuple(params.items()), cost,
+        hist.index[0].value, hist.index[-1].value, len(hist), float(close[-1])
+    )
+    plot_cached_figure(key, lambda: build_backtest_chart(ticker, strategy, hist, result, benchmark))
+    
+    if grid:
+        display_parameter_sweep(ticker, period, strategy, grid, cost)
+
+def display_backtest_metrics(result, benchmark):
+    """Display strategy statistics next to buy & hold"""
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Total Return", f"{result['total_return']*100:+.1f}%",
+                  f"{(result['total_return'] - benchmark['total_return'])*100:+.1f}% vs buy & hold")
+    with col2:
+        st.metric("Sharpe Ratio", f"{result['sharpe']:.2f}", f"{result['sharpe'] - benchmark['sharpe']:+.2f}")
+    with col3:
+        st.metric("Max Drawdown", f"{result['max_drawdown']*100:.1f}%",
+                  f"{(result['max_drawdown'] - benchmark['max_drawdown'])*100:+.1f}%")
+    with col4:
+        st.metric("Trades", f"{result['trades']:,}", f"{result['exposure']*100:.0f}% time invested", delta_color="off")
+    
+    st.caption(
+        f"Annualized return {result['annual_return']*100:+.2f}% (buy & hold {benchmark['annual_return']*100:+.2f}%) · "
+        f"volatility {result['volatility']*100:.1f}%. Signals trade at the next close."
+    )
+
+def build_backtest_chart(ticker, strategy, hist, result, benchmark):
+    """Build the equity curve and drawdown figure"""
+    fig = make_subplots(
+        rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.05, row_heights=[0.7, 0.3],
+        subplot_titles=[f"{ticker} - {strategy} vs Buy & Hold (growth of $1)", "Drawdown"]
+    )
+    add_line(fig, hist, result['equity'], 1, name=strategy, line=dict(color='#667eea', width=2))
+    add_line(fig, hist, benchmark['equity'], 1, name='Buy & Hold', line=dict(color='gray', width=1))
+    add_line(fig, hist, result['drawdown'] * 100, 2, name='Strategy Drawdown',
+             line=dict(color='red', width=1), fill='tozeroy')
+    fig.update_layout(height=600, showlegend=True)
+    fig.update_yaxes(title_text="Equity ($)", row=1, col=1)
+    fig.update_yaxes(title_text="Drawdown (%)", row=2, col=1)
+    return fig
+
+@st.cache_data(ttl=3600, max_entries=32)  # Cache sweeps for an hour
+def cached_parameter_sweep(ticker, period, strategy, grid, cost, last_bar):
+    """Cached grid sweep; last_bar keys the result to the bars it was run on"""
+    hist = load_period_history(ticker, period)
+    started = time.perf_counter()
+    table = analytics.sweep_parameters(BACKTEST_STRATEGIES[strategy][1], hist['Close'].to_numpy(), list(grid), cost)
+    return table, time.perf_counter() - started
+
+def display_parameter_sweep(ticker, period, strategy, grid, cost):
+    """Display the Sharpe ratio of every parameter set in the grid"""
+    st.subheader("🔬 Parameter Sweep")
+    hist = load_period_history(ticker, period)
+    with st.spinner(f"Backtesting {len(grid):,} parameter sets..."):
+        table, elapsed = cached_parameter_sweep(ticker, period, strategy, grid, cost, hist.index[-1].value)
+    
+    x, y = ('slow', 'fast') if strategy == "MA Crossover" else ('upper', 'lower')
+    sharpe = table.pivot(index=y, columns=x, values='sharpe')
+    fig = go.Figure(go.Heatmap(
+        z=sharpe.to_numpy(), x=sharpe.columns, y=sharpe.index,
+        colorscale='RdYlGn', zmid=0, colorbar=dict(title="Sharpe")
+    ))
+    fig.update_layout(
+        title=f"Sharpe Ratio by {y.title()} / {x.title()}", height=500,
+        xaxis_title=x.title(), yaxis_title=y.title()
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    
+    best = table.sort_values('sharpe', ascending=False).head(10)
+    st.dataframe(best.style.format({
+        'total_return': '{:+.1%}', 'annual_return': '{:+.2%}', 'volatility': '{:.1%}',
+        'sharpe': '{:.2f}', 'max_drawdown': '{:.1%}', 'trades': '{:,.0f}'
+    }), use_container_width=True, hide_index=True)
+    st.caption(f"Tested {len(table):,} parameter sets in {elapsed:.2f}s. Best in-sample results overstate what to expect going forward.")
+
+# =============================================================================
+# PORTFOLIO ANALYTICS FUNCTIONS
+# =============================================================================
+
+def show_portfolio_analyzer():
+    """Display portfolio risk analytics and the efficient frontier"""
+    st.header("📐 Portfolio Analytics & Efficient Frontier")
+    
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        st.subheader("Portfolio")
+        selected = st.multiselect("Holdings:", POPULAR_STOCKS, default=POPULAR_STOCKS[:5], key="pf_tickers")
+        extra = parse_symbols(st.text_input("More symbols (comma separated):", "", key="pf_extra"))
+        benchmark = parse_symbol(st.text_input("Benchmark:", "SPY", key="pf_benchmark"))
+        period = st.selectbox("History:", ["1y", "2y", "5y", "10y", "max"], index=2, key="pf_period")
+        risk_free = st.number_input("Risk-Free Rate (%):", min_value=0.0, max_value=20.0, value=2.0, step=0.25, key="pf_rf") / 100
+        allow_short = st.checkbox("Allow short positions", key="pf_short")
+    
+    tickers = tuple(dict.fromkeys(list(selected) + extra))
+    if len(tickers) < 2:
+        with col2:
+            st.info("Pick at least two holdings.")
+        return
+    
+    with col1:
+        weights = get_portfolio_weights(tickers)
+    
+    with col2:
+        analyze_and_display_portfolio(tickers, weights, benchmark, period, risk_free, allow_short)
+
+def get_portfolio_weights(tickers):
+    """Editable weight per holding, normalized to sum to 1"""
+    st.subheader("Weights")
+    table = st.data_editor(
+        pd.DataFrame({'Symbol': tickers, 'Weight (%)': [round(100 / len(tickers), 2)] * len(tickers)}),
+        disabled=['Symbol'], hide_index=True, use_container_width=True,
+        key="pf_weights_" + "_".join(tickers)
+    )
+    weights = table['Weight (%)'].fillna(0).to_numpy(dtype=float)
+    if weights.sum() == 0:
+        return np.full(len(tickers), 1 / len(tickers))
+    return weights / weights.sum()
+
+@st.cache_data(ttl=3600, max_entries=32)  # Cache for an hour
+def cached_efficient_frontier(mean, cov, allow_short):
+    """Cached efficient frontier for the given annualized means and covariance"""
+    return analytics.efficient_frontier(mean, cov, allow_short=allow_short)
+
+@st.cache_data(ttl=3600, max_entries=32)  # Cache for an hour
+def cached_max_sharpe_weights(mean, cov, risk_free, allow_short):
+    """Cached tangency portfolio weights"""
+    return analytics.max_sharpe_weights(mean, cov, risk_free, allow_short)
+
+def analyze_and_display_portfolio(tickers, weights, benchmark, period, risk_free, allow_short):
+    """Build the return matrix from stored histories and display the portfolio analytics"""
+    try:
+        # One batched sync for every holding; stored histories are reused, not refetched
+        histories = cached_fetch_price_histories(tuple(sorted(set(tickers) | ({benchmark} if benchmark else set()))))
+    except Exception as e:
+        display_fetch_error(e, ", ".join(tickers))
+        return
+    
+    missing = [ticker for ticker in tickers if ticker not in histories]
+    if missing:
+        st.warning(f"No data found for: {', '.join(missing)}. They are left out of the analysis.")
+    keep = [i for i, ticker in enumerate(tickers) if ticker in histories]
+    if len(keep) < 2:
+        return
+    tickers = [tickers[i] for i in keep]
+    weights = weights[keep] / weights[keep].sum()
+    
+    closes = {ticker: slice_period(histories[ticker], period)['Close'] for ticker in tickers}
+    has_benchmark = benchmark in histories
+    if has_benchmark and benchmark not in closes:
+        # A held benchmark already has its column, which doubles as the benchmark returns
+        closes[benchmark] = slice_period(histories[benchmark], period)['Close']
+    returns = analytics.return_matrix(closes)
+    if len(returns) < 30:
+        st.warning("Not enough overlapping history between these holdings.")
+        return
+    
+    asset_returns = returns[tickers].to_numpy()
+    benchmark_returns = returns[benchmark].to_numpy() if has_benchmark else None
+    stats = analytics.portfolio_statistics(asset_returns, weights, benchmark_returns, risk_free)
+    mean = asset_returns.mean(axis=0) * analytics.TRADING_DAYS
+    cov = np.cov(asset_returns, rowvar=False) * analytics.TRADING_DAYS
+    
+    display_portfolio_metrics(stats, benchmark if has_benchmark else None, returns.index)
+    
+    with st.spinner("Tracing the efficient frontier..."):
+        frontier = cached_efficient_frontier(mean, cov, allow_short)
+        best_weights = cached_max_sharpe_weights(mean, cov, risk_free, allow_short)
+    
+    st.subheader("🎯 Efficient Frontier")
+    key = (
+        'efficient_frontier', tuple(tickers), period, returns.index[-1].value, len(returns),
+        tuple(np.round(weights, 6)), risk_free, allow_short
+    )
+    plot_cached_figure(key, lambda: build_efficient_frontier_chart(tickers, mean, cov, weights, frontier, best_weights, risk_free))
+    
+    st.subheader("🔗 Correlation")
+    plot_cached_figure(('correlation', tuple(tickers), period, returns.index[-1].value, len(returns)),
+                       lambda: build_correlation_heatmap(tickers, asset_returns))
+    
+    display_portfolio_weights(tickers, weights, best_weights, frontier[2][0], mean, cov, stats['asset_betas'])
+
+def display_portfolio_metrics(stats, benchmark, dates):
+    """Display the portfolio's headline statistics"""
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Expected Return", f"{stats['annual_return']*100:.2f}%")
+    with col2:
+        st.metric("Volatility", f"{stats['volatility']*100:.2f}%")
+    with col3:
+        st.metric("Sharpe Ratio", f"{stats['sharpe']:.2f}")
+    with col4:
+        st.metric(f"Beta vs {benchmark}" if benchmark else "Beta", f"{stats['beta']:.2f}" if benchmark else "N/A")
+    st.caption(f"Annualized from {len(dates):,} trading days ({dates[0]:%b %Y} – {dates[-1]:%b %Y}) when every holding traded.")
+
+def build_efficient_frontier_chart(tickers, mean, cov, weights, frontier, best_weights, risk_free):
+    """Build the frontier chart with each asset, the portfolio and the optimal portfolios"""
+    targets, volatilities, _ = frontier
+    asset_vols = np.sqrt(np.diag(cov))
+    
+    def point(w):
+        return np.sqrt(w @ cov @ w) * 100, (w @ mean) * 100
+    
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=volatilities * 100, y=targets * 100, mode='lines', name='Efficient Frontier',
+                             line=dict(color='#667eea', width=3)))
+    fig.add_trace(go.Scatter(x=asset_vols * 100, y=mean * 100, mode='markers+text', name='Holdings',
+                             text=list(tickers), textposition='top center', marker=dict(size=9, color='gray')))
+    best_vol, best_return = point(best_weights)
+    fig.add_trace(go.Scatter(x=[0, best_vol * 1.5], y=[risk_free * 100, risk_free * 100 + (best_return - risk_free * 100) * 1.5],
+                             mode='lines', name='Capital Market Line', line=dict(color='green', dash='dash')))
+    for w, name, symbol, color in [
+        (weights, 'Your Portfolio', 'star', 'orange'),
+        (best_weights, 'Max Sharpe', 'diamond', 'green'),
+        (frontier[2][0], 'Min Volatility', 'circle', 'red'),
+    ]:
+        vol, ret = point(w)
+        fig.add_trace(go.Scatter(x=[vol], y=[ret], mode='markers', name=name,
+                                 marker=dict(size=16, symbol=symbol, color=color, line=dict(width=1, color='black'))))
+    fig.update_layout(height=550, xaxis_title="Volatility (% per year)", yaxis_title="Expected Return (% per year)")
+    return fig
+
+def build_correlation_heatmap(tickers, asset_returns):
+    """Build the return correlation heatmap"""
+    corr = np.corrcoef(asset_returns, rowvar=False)
+    fig = go.Figure(go.Heatmap(
+        z=corr, x=list(tickers), y=list(tickers), zmin=-1, zmax=1, colorscale='RdBu', reversescale=True,
+        text=np.round(corr, 2), texttemplate="%{text}" if len(tickers) <= 15 else None
+    ))
+    fig.update_layout(height=max(400, 25 * len(tickers)))
+    return fig
+
+def display_portfolio_weights(tickers, weights, best_weights, min_vol_weights, mean, cov, asset_betas):
+    """Display the holdings table with each portfolio's weights"""
+    table = pd.DataFrame({
+        'Symbol': tickers,
+        'Your Weight': weights,
+        'Max Sharpe': best_weights,
+        'Min Volatility': min_vol_weights,
+        'Expected Return': mean,
+        'Volatility': np.sqrt(np.diag(cov)),
+        'Beta': asset_betas,
+    })
+    st.dataframe(table.style.format({
+        'Your Weight': '{:.1%}', 'Max Sharpe': '{:.1%}', 'Min Volatility': '{:.1%}',
+        'Expected Return': '{:.2%}', 'Volatility': '{:.2%}', 'Beta': '{:.2f}'
+    }), use_container_width=True, hide_index=True)
+    st.caption("Expected returns are historical averages; optimized weights are very sensitive to them.")
+
 # =============================================================================
 # INVESTMENT CALCULATOR FUNCTIONS - FIXED VERSION
 # =============================================================================
@@ -451,6 +1251,10 @@ def show_investment_calculator():
     # Calculate and display results
     if st.button("🚀 Calculate Future Value", type="primary"):
         calculate_and_display_investment_results(investment_params)
+    
+    show_goal_seek(investment_params)
+    show_sensitivity_analysis(investment_params)
+    show_scenario_comparison()
 
 def get_investment_inputs():
     """Get user inputs for investment calculation"""
@@ -461,7 +1265,7 @@ def get_investment_inputs():
         initial_investment = st.number_input("Initial Investment ($)", min_value=0.0, value=10000.0, step=1000.0)
         monthly_contribution = st.number_input("Monthly Contribution ($)", min_value=0.0, value=500.0, step=100.0)
         years = st.slider("Investment Period (Years)", min_value=1, max_value=50, value=20)
-        investment_type = st.selectbox("Investment Type", ["Stocks", "Bonds", "Real Estate", "Mixed Portfolio", "Cryptocurrency"])
+        investment_type = st.selectbox("Investment Type", INVESTMENT_TYPES)
     
     with col2:
         st.subheader("Return Expectations")
@@ -469,6 +1273,9 @@ def get_investment_inputs():
         inflation = st.slider("Expected Annual Inflation (%)", min_value=0.0, max_value=10.0, value=2.5, step=0.1)
         contribution_increase = st.slider("Annual Contribution Increase (%)", min_value=0.0, max_value=10.0, value=2.0, step=0.5)
         tax_rate = st.slider("Estimated Tax Rate on Gains (%)", min_value=0.0, max_value=50.0, value=15.0, step=1.0)
+        simulations = st.select_slider("Monte Carlo Paths", options=MONTE_CARLO_PATH_OPTIONS, value=MONTE_CARLO_SIMULATIONS,
+                                       format_func=lambda n: f"{n:,}")
+    return_source = get_return_source_inputs("investment")
     
     return {
         'initial_investment': float(initial_investment),
@@ -478,7 +1285,9 @@ def get_investment_inputs():
         'expected_return': float(expected_return),
         'inflation': float(inflation),
         'contribution_increase': float(contribution_increase),
-        'tax_rate': float(tax_rate)
+        'tax_rate': float(tax_rate),
+        'simulations': int(simulations),
+        'return_source': return_source
     }
 
 def calculate_and_display_investment_results(params):
@@ -513,47 +1322,27 @@ def calculate_advanced_investment(initial_investment, monthly_contribution, year
         contribution_increase = float(contribution_increase)
         tax_rate = float(tax_rate)
         
-        monthly_rate = expected_return / 100 / 12
-        months = years * 12
-        
-        # Calculate future value with compounding
-        future_value = initial_investment
-        total_contributions = initial_investment
-        current_monthly = monthly_contribution
-        
-        projection_data = []
-        
-        for year in range(1, years + 1):
-            # Add monthly contributions for the year
-            for month in range(12):
-                future_value += current_monthly
-                future_value *= (1 + monthly_rate)
-                total_contributions += current_monthly
-            
-            projection_data.append({
-                'Year': year,
-                'Portfolio Value': float(future_value),
-                'Contributions': float(total_contributions)
-            })
-            
-            # Increase monthly contribution for next year
-            current_monthly *= (1 + contribution_increase / 100)
-        
-        # Calculate taxes and inflation adjustments
-        interest_earned = future_value - total_contributions
-        taxes_paid = interest_earned * (tax_rate / 100)
-        after_tax = future_value - taxes_paid
-        real_value = after_tax / ((1 + inflation/100) ** years)
+        # Closed-form, vectorized projection (same numbers as compounding month by month)
+        outcome = analytics.investment_outcomes(
+            initial_investment, monthly_contribution, years, expected_return,
+            inflation, contribution_increase, tax_rate
+        )
+        projection = outcome['projection']
+        projection_data = pd.DataFrame({
+            'Year': np.arange(1, years + 1),
+            'Portfolio Value': projection['value'],
+            'Contributions': projection['contributions']
+        })
         
         return {
-            'future_value': float(future_value),
-            'real_value': float(real_value),
-            'after_tax': float(after_tax),
-            'interest_earned': float(interest_earned),
-            'taxes_paid': float(taxes_paid),
+            'future_value': float(outcome['future_value']),
+            'real_value': float(outcome['real_value']),
+            'after_tax': float(outcome['after_tax']),
+            'interest_earned': float(outcome['interest_earned']),
+            'taxes_paid': float(outcome['taxes_paid']),
             'initial_investment': float(initial_investment),
-            'total_contributions': float(total_contributions),
-            'projection_data': pd.DataFrame(projection_data)
+            'total_contributions': float(outcome['total_contributions']),
+            'projection_data': projection_data
         }
     
     except Exception as e:
@@ -656,8 +1445,34 @@ def analyze_investment_risk(investment_type, expected_return, years):
 
 def display_investment_visualizations(results, params):
     """Display investment visualizations and charts"""
+    params_key = tuple(sorted(params.items()))
+    
     # Investment breakdown pie chart
     st.subheader("📈 Investment Breakdown")
+    plot_cached_figure(('investment_breakdown', params_key), lambda: build_investment_breakdown_chart(results))
+    
+    # Growth projection chart
+    st.subheader("📊 Growth Projection")
+    if not results['projection_data'].empty:
+        plot_cached_figure(('investment_projection', params_key), lambda: build_investment_projection_chart(results))
+    
+    # Monte Carlo simulation
+    st.subheader("🎯 Monte Carlo Simulation")
+    simulation_inputs = (
+        results['initial_investment'], 
+        params['monthly_contribution'],
+        params['years'], 
+        params['expected_return'],
+        params['contribution_increase'],
+        params['simulations']
+    )
+    simulation = run_simulation(run_monte_carlo_simulation, simulation_inputs, params['return_source'])
+    if simulation:
+        plot_cached_figure(('monte_carlo',) + simulation_inputs + simulation['return_key'], lambda: build_monte_carlo_chart(simulation))
+        display_monte_carlo_summary(simulation, results)
+
+def build_investment_breakdown_chart(results):
+    """Build the investment composition pie chart"""
     breakdown_data = {
         "Component": ["Initial Investment", "Total Contributions", "Interest Earned", "Taxes", "Net Value"],
         "Amount": [
@@ -669,81 +1484,306 @@ def display_investment_visualizations(results, params):
         ]
     }
     
-    fig_pie = px.pie(breakdown_data, values='Amount', names='Component', title="Investment Composition")
-    st.plotly_chart(fig_pie, use_container_width=True)
-    
-    # Growth projection chart
-    st.subheader("📊 Growth Projection")
-    if not results['projection_data'].empty:
-        fig_projection = px.line(results['projection_data'], x='Year', y='Portfolio Value', 
-                               title="Portfolio Growth Over Time")
-        fig_projection.update_traces(line=dict(width=4))
-        st.plotly_chart(fig_projection, use_container_width=True)
-    
-    # Monte Carlo simulation
-    st.subheader("🎯 Monte Carlo Simulation")
-    monte_carlo_paths = run_monte_carlo_simulation(
-        results['initial_investment'], 
-        params['monthly_contribution'] * 12,  # Annual contribution
-        params['years'], 
-        params['expected_return']
-    )
-    if monte_carlo_paths:
-        display_monte_carlo_chart(monte_carlo_paths, params['years'])
+    return px.pie(breakdown_data, values='Amount', names='Component', title="Investment Composition")
+
+def build_investment_projection_chart(results):
+    """Build the portfolio growth line chart"""
+    fig_projection = px.line(results['projection_data'], x='Year', y='Portfolio Value', 
+                           title="Portfolio Growth Over Time")
+    fig_projection.update_traces(line=dict(width=4))
+    return fig_projection
+
+# Investment calculator inputs -> analytics.investment_outcomes arguments
+INVESTMENT_ARGUMENTS = {
+    'initial_investment': 'initial',
+    'monthly_contribution': 'monthly',
+    'years': 'years',
+    'expected_return': 'annual_return',
+    'inflation': 'inflation',
+    'contribution_increase': 'contribution_increase',
+    'tax_rate': 'tax_rate',
+}
+
+INVESTMENT_TYPES = ["Stocks", "Bonds", "Real Estate", "Mixed Portfolio", "Cryptocurrency"]
+
+# Scenario table column -> analytics.investment_outcomes argument
+SCENARIO_COLUMNS = {
+    "Initial ($)": 'initial',
+    "Monthly ($)": 'monthly',
+    "Years": 'years',
+    "Return (%)": 'annual_return',
+    "Inflation (%)": 'inflation',
+    "Contribution Growth (%)": 'contribution_increase',
+    "Tax Rate (%)": 'tax_rate',
+}
+
+DEFAULT_SCENARIOS = pd.DataFrame([
+    ["Conservative", "Bonds", 10000.0, 500.0, 20, 4.0, 2.5, 2.0, 15.0],
+    ["Balanced", "Mixed Portfolio", 10000.0, 500.0, 20, 7.0, 2.5, 2.0, 15.0],
+    ["Growth", "Stocks", 10000.0, 500.0, 20, 10.0, 2.5, 3.0, 20.0],
+], columns=["Scenario", "Investment Type"] + list(SCENARIO_COLUMNS))
+
+def show_scenario_comparison():
+    """Compare several named investment scenarios on one chart and table"""
+    with st.expander("⚖️ Compare Scenarios"):
+        st.caption("Add, edit or remove rows. Only new or edited scenarios are recalculated.")
+        table = st.data_editor(
+            DEFAULT_SCENARIOS, num_rows="dynamic", hide_index=True, use_container_width=True, key="scenario_table",
+            column_config={
+                "Investment Type": st.column_config.SelectboxColumn(options=INVESTMENT_TYPES, required=True),
+                "Years": st.column_config.NumberColumn(min_value=1, max_value=50, step=1, required=True),
+            }
+        )
+        table = table.dropna(subset=list(SCENARIO_COLUMNS))
+        if table.empty:
+            st.info("Add at least one complete scenario to compare.")
+            return
+        
+        names = [name if isinstance(name, str) and name else f"Scenario {i + 1}" for i, name in enumerate(table["Scenario"])]
+        scenarios = table[list(SCENARIO_COLUMNS)].rename(columns=SCENARIO_COLUMNS).to_dict('records')
+        results, evaluated = analytics.compare_scenarios(scenarios)
+        
+        figure_key = ('scenarios', tuple(names), tuple(analytics.scenario_key(scenario) for scenario in scenarios))
+        plot_cached_figure(figure_key, lambda: build_scenario_chart(names, scenarios, results))
+        display_scenario_table(names, table["Investment Type"], scenarios, results)
+        st.caption(f"{evaluated} of {len(results)} scenarios calculated this run, the rest came from cache.")
 
-def run_monte_carlo_simulation(initial, annual_contribution, years, expected_return, simulations=100):
-    """Run Monte Carlo simulation for investment returns"""
-    try:
-        results = []
+def build_scenario_chart(names, scenarios, results):
+    """Build one growth line per scenario"""
+    fig = go.Figure()
+    for name, scenario, result in zip(names, scenarios, results):
+        values = np.concatenate([[scenario['initial']], result['value']])
+        fig.add_trace(go.Scatter(x=np.arange(len(values)), y=values, mode='lines', name=name))
+    fig.update_layout(title="Portfolio Value by Scenario", xaxis_title="Years", yaxis_title="Portfolio Value ($)", hovermode='x unified')
+    return fig
+
+def display_scenario_table(names, investment_types, scenarios, results):
+    """Display the outcome of every scenario side by side"""
+    st.dataframe(pd.DataFrame({
+        "Scenario": names,
+        "Risk": [analyze_investment_risk(investment_type, scenario['annual_return'], scenario['years'])['risk_level'].title()
+                 for investment_type, scenario in zip(investment_types, scenarios)],
+        "Future Value": [f"${result['future_value']:,.0f}" for result in results],
+        "After Tax": [f"${result['after_tax']:,.0f}" for result in results],
+        "Real Value": [f"${result['real_value']:,.0f}" for result in results],
+        "Contributions": [f"${result['total_contributions']:,.0f}" for result in results],
+        "Interest Earned": [f"${result['interest_earned']:,.0f}" for result in results],
+    }), hide_index=True, use_container_width=True)
+
+# Goal seek label -> (analytics solver, input it replaces, result format)
+GOAL_SEEK_SOLVERS = {
+    "Monthly Contribution": (analytics.required_contribution, 'monthly_contribution', "${:,.2f} / month"),
+    "Expected Return": (analytics.required_return, 'expected_return', "{:.2f}% / year"),
+    "Years": (analytics.years_to_target, 'years', "{:.1f} years"),
+}
+
+GOAL_MEASURES = {"After-Tax Value": 'after_tax', "Real Value": 'real_value', "Future Value": 'future_value'}
+
+def show_goal_seek(params):
+    """Solve for the contribution, return or horizon that reaches target amounts"""
+    with st.expander("🎯 Goal Seek - what does it take to reach a target?"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            solve_for = st.selectbox("Solve For", list(GOAL_SEEK_SOLVERS), key="goal_solve_for")
+        with col2:
+            measure = st.selectbox("Target Measure", list(GOAL_MEASURES), key="goal_measure")
+        with col3:
+            targets_text = st.text_input("Targets ($, comma separated)", "250000, 500000, 1000000, 2000000", key="goal_targets")
         
-        for _ in range(simulations):
-            portfolio_value = float(initial)
-            path = [portfolio_value]
-            
-            for year in range(years):
-                # Random return based on expected return with some volatility
-                annual_return = np.random.normal(expected_return, max(expected_return * 0.3, 5)) / 100
-                portfolio_value = portfolio_value * (1 + annual_return) + annual_contribution
-                path.append(max(portfolio_value, 0))  # Ensure non-negative
-            
-            results.append(path)
+        try:
+            targets = np.array([float(t.replace("$", "").replace("_", "")) for t in targets_text.split(",") if t.strip()])
+        except ValueError:
+            st.error("Targets must be numbers, e.g. 500000, 1000000")
+            return
+        if not len(targets):
+            return
+        
+        solver, replaced, result_format = GOAL_SEEK_SOLVERS[solve_for]
+        # Every input except the one being solved for, under the solver's argument names
+        inputs = {INVESTMENT_ARGUMENTS[name]: value for name, value in params.items() if name in INVESTMENT_ARGUMENTS and name != replaced}
+        solutions = solver(targets, **inputs, measure=GOAL_MEASURES[measure])
+        
+        st.dataframe(pd.DataFrame({
+            f"Target {measure}": [f"${target:,.0f}" for target in targets],
+            f"Required {solve_for}": [result_format.format(x) if np.isfinite(x) else "Not reachable" for x in solutions],
+        }), hide_index=True, use_container_width=True)
+        st.caption("All other inputs stay as set above.")
+
+# Axis label -> (input, values swept), covering each slider's full range
+SENSITIVITY_AXES = {
+    "Expected Return (%)": ('expected_return', np.arange(1.0, 30.5, 0.5)),
+    "Investment Period (Years)": ('years', np.arange(1, 51)),
+    "Monthly Contribution ($)": ('monthly_contribution', np.arange(0.0, 5001.0, 100.0)),
+    "Inflation (%)": ('inflation', np.arange(0.0, 10.1, 0.25)),
+    "Contribution Increase (%)": ('contribution_increase', np.arange(0.0, 10.5, 0.5)),
+    "Tax Rate (%)": ('tax_rate', np.arange(0.0, 51.0, 1.0)),
+}
+
+SENSITIVITY_MEASURES = {"After-Tax Value": 'after_tax', "Real Value": 'real_value'}
+
+def show_sensitivity_analysis(params):
+    """Display after-tax or real value over a whole grid of input combinations"""
+    with st.expander("🔬 Sensitivity Analysis - every combination at once"):
+        labels = list(SENSITIVITY_AXES)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            x_label = st.selectbox("Horizontal Axis", labels, index=1, key="sens_x")
+        with col2:
+            y_label = st.selectbox("Vertical Axis", [l for l in labels if l != x_label], key="sens_y")
+        with col3:
+            slice_label = st.selectbox("Third Dimension", ["None"] + [l for l in labels if l not in (x_label, y_label)], key="sens_z")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            measure = st.radio("Show", list(SENSITIVITY_MEASURES), horizontal=True, key="sens_measure")
+        with col2:
+            chart_type = st.radio("Chart", ["Heatmap", "Contour"], horizontal=True, key="sens_chart")
+        
+        axes = (y_label, x_label) + ((slice_label,) if slice_label != "None" else ())
+        base = tuple(sorted((INVESTMENT_ARGUMENTS[name], value) for name, value in params.items() if name in INVESTMENT_ARGUMENTS))
+        values = cached_sensitivity_grid(base, axes)[SENSITIVITY_MEASURES[measure]]
+        scenarios = values.size
+        figure_key = ('sensitivity', base, axes, measure, chart_type)
+        
+        if slice_label != "None":
+            # The 3-D grid is computed once; moving this slider only picks another slice
+            options = SENSITIVITY_AXES[slice_label][1]
+            current = params[SENSITIVITY_AXES[slice_label][0]]
+            index = options.tolist().index(st.select_slider(
+                slice_label, options=options.tolist(), value=options[np.abs(options - current).argmin()].item(), key="sens_slice"
+            ))
+            values = values[..., index]
+            figure_key += (index,)
         
-        return results
+        plot_cached_figure(
+            figure_key,
+            lambda: build_sensitivity_chart(values, x_label, y_label, measure, chart_type, params)
+        )
+        st.caption(f"{scenarios:,} scenarios evaluated in one pass. The marker shows your current inputs.")
+
+@st.cache_data(ttl=3600, max_entries=16)  # Cache grids for an hour
+def cached_sensitivity_grid(base, axes):
+    """Cached outcomes over the grid of the given axes"""
+    return analytics.sensitivity_grid(
+        dict(base), [(INVESTMENT_ARGUMENTS[SENSITIVITY_AXES[label][0]], SENSITIVITY_AXES[label][1]) for label in axes]
+    )
+
+def build_sensitivity_chart(values, x_label, y_label, measure, chart_type, params):
+    """Build the heatmap or contour of one outcome over two inputs"""
+    x_name, x_values = SENSITIVITY_AXES[x_label]
+    y_name, y_values = SENSITIVITY_AXES[y_label]
+    trace = go.Heatmap if chart_type == "Heatmap" else go.Contour
+    fig = go.Figure(trace(
+        x=x_values, y=y_values, z=values, colorscale='Viridis', colorbar=dict(title=measure),
+        hovertemplate=f"{x_label}: %{{x}}<br>{y_label}: %{{y}}<br>{measure}: $%{{z:,.0f}}<extra></extra>"
+    ))
+    fig.add_trace(go.Scatter(
+        x=[params[x_name]], y=[params[y_name]], mode='markers', name='Your inputs',
+        marker=dict(size=12, color='white', line=dict(width=2, color='black'))
+    ))
+    fig.update_layout(title=f"{measure} by {x_label} and {y_label}", xaxis_title=x_label, yaxis_title=y_label, height=550)
+    return fig
+
+MONTE_CARLO_SIMULATIONS = 100_000
+MONTE_CARLO_PATH_OPTIONS = [10_000, 100_000, 1_000_000, 10_000_000]
+MONTE_CARLO_SEED = 42  # Fixed so the same inputs always show the same bands
+
+MONTE_CARLO_RETURN_MODELS = ["Normal returns", "Historical block bootstrap"]
+MIN_HISTORY_MONTHS = 36
+
+def get_return_source_inputs(key):
+    """Choose normal returns or resampling the history of a ticker or portfolio.
+
+    Returns () for normal returns, else (tickers, match_expected_return).
+    """
+    model = st.radio("Monte Carlo Returns", MONTE_CARLO_RETURN_MODELS, horizontal=True, key=f"{key}_return_model")
+    if model == MONTE_CARLO_RETURN_MODELS[0]:
+        return ()
     
+    symbols = st.text_input("Resample the history of (comma separated, equal weights):", "SPY", key=f"{key}_history")
+    tickers = tuple(dict.fromkeys(parse_symbols(symbols)))
+    match_expected_return = st.checkbox("Shift history to my expected return", value=True, key=f"{key}_match_return",
+                                        help="Keeps the history's swings and streaks but centers it on the return above")
+    return (tickers or ("SPY",), match_expected_return)
+
+def run_simulation(simulate, simulation_inputs, return_source):
+    """Run a cached simulation with the chosen return model, or show why it failed and return None.
+
+    Price history is loaded out here so that a failed download is never cached
+    with the simulation.
+    """
+    try:
+        options = get_return_model_options(return_source)
+        simulation = simulate(*simulation_inputs, **options)
     except Exception as e:
         st.error(f"Error in Monte Carlo simulation: {str(e)}")
-        return []
+        return None
+    
+    # Identifies the history used, for figure cache keys
+    history_months = len(options['historical_returns']) if options else 0
+    return simulation | {'label': describe_return_source(return_source), 'return_key': (return_source, history_months)}
+
+def get_return_model_options(return_source):
+    """Keyword arguments that make the simulation resample historical monthly returns"""
+    if not return_source:
+        return {}
+    tickers, match_expected_return = return_source
+    closes = {ticker: load_period_history(ticker, "max")['Close'] for ticker in tickers}
+    historical_returns = analytics.monthly_log_returns(closes)
+    if len(historical_returns) < MIN_HISTORY_MONTHS:
+        raise ValueError(f"{', '.join(tickers)} has only {len(historical_returns)} months of shared history, "
+                         f"at least {MIN_HISTORY_MONTHS} are needed")
+    return {'historical_returns': historical_returns, 'match_expected_return': match_expected_return}
+
+@st.cache_data(ttl=3600, max_entries=32)  # Cache simulations for an hour
+def run_monte_carlo_simulation(initial, monthly_contribution, years, expected_return, contribution_increase=0.0,
+                               simulations=MONTE_CARLO_SIMULATIONS, historical_returns=None, match_expected_return=True,
+                               seed=MONTE_CARLO_SEED):
+    """Run Monte Carlo simulation for investment returns, reduced to percentile bands"""
+    # Random returns around the expected return with some volatility
+    volatility = max(expected_return * 0.3, 5)
+    return analytics.simulate_investment(
+        initial, monthly_contribution, years, expected_return, volatility,
+        simulations=simulations, contribution_increase=contribution_increase, seed=seed,
+        historical_returns=historical_returns, match_expected_return=match_expected_return
+    )
+
+def describe_return_source(return_source):
+    """Chart title suffix naming the resampled history"""
+    return f" (resampling {', '.join(return_source[0])} history)" if return_source else ""
 
-def display_monte_carlo_chart(monte_carlo_paths, years):
-    """Display Monte Carlo simulation chart"""
+def build_monte_carlo_chart(simulation):
+    """Build the Monte Carlo percentile fan chart"""
+    years = simulation['years']
+    bands = simulation['percentiles']
     fig = go.Figure()
     
-    # Plot individual simulation paths
-    for i in range(min(50, len(monte_carlo_paths))):
-        fig.add_trace(go.Scatter(
-            x=list(range(years + 1)),
-            y=monte_carlo_paths[i],
-            mode='lines',
-            line=dict(width=1, color='lightblue'),
-            showlegend=False
-        ))
+    # Outer band first so the inner band and median draw on top of it
+    for low, high, color, name in [(5, 95, 'rgba(102, 126, 234, 0.2)', '5th–95th percentile'),
+                                   (25, 75, 'rgba(102, 126, 234, 0.4)', '25th–75th percentile')]:
+        fig.add_trace(go.Scatter(x=years, y=bands[low], mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=years, y=bands[high], mode='lines', line=dict(width=0), fill='tonexty',
+                                 fillcolor=color, name=name))
     
-    # Add mean line
-    mean_path = np.mean(monte_carlo_paths, axis=0)
-    fig.add_trace(go.Scatter(
-        x=list(range(years + 1)),
-        y=mean_path,
-        mode='lines',
-        line=dict(width=3, color='red'),
-        name='Average Path'
-    ))
+    fig.add_trace(go.Scatter(x=years, y=bands[50], mode='lines', line=dict(width=3, color='red'), name='Median Path'))
     
     fig.update_layout(
-        title="Monte Carlo Simulation - Possible Investment Paths",
+        title=f"Monte Carlo Simulation - {simulation['simulations']:,} Possible Investment Paths{simulation.get('label', '')}",
         xaxis_title="Years",
         yaxis_title="Portfolio Value ($)"
     )
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
+
+def display_monte_carlo_summary(simulation, results):
+    """Summarize the spread of simulated outcomes"""
+    bands = simulation['percentiles']
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Median Outcome", f"${bands[50][-1]:,.0f}")
+    with col2:
+        st.metric("Pessimistic (5th pct)", f"${bands[5][-1]:,.0f}")
+    with col3:
+        st.metric("Chance to beat the projection", f"{(1 - simulation['final'].fraction_below(results['future_value']))*100:.0f}%")
 
 # =============================================================================
 # CURRENCY CONVERTER FUNCTIONS
@@ -764,6 +1804,8 @@ def show_currency_converter():
     # Perform conversion
     if st.button("🔁 Convert Currency", type="primary"):
         convert_currency(amount, base_currency, target_currency)
+    
+    display_cross_rates()
 
 def get_currency_inputs():
     """Get user inputs for currency conversion"""
@@ -772,23 +1814,26 @@ def get_currency_inputs():
     
     col1a, col1b = st.columns(2)
     with col1a:
-        base_currency = st.selectbox("From", ["USD", "EUR", "IDR", "SGD", "MYR", "JPY", "GBP", "AUD"], index=0)
+        base_currency = st.selectbox("From", CONVERTER_CURRENCIES, index=0)
     with col1b:
-        target_currency = st.selectbox("To", ["IDR", "USD", "EUR", "SGD", "MYR", "JPY", "GBP", "AUD"], index=1)
+        target_currency = st.selectbox("To", CONVERTER_CURRENCIES, index=2)
     
     return amount, base_currency, target_currency
 
+CONVERTER_CURRENCIES = ["USD", "EUR", "IDR", "SGD", "MYR", "JPY", "GBP", "AUD"]
+
+POPULAR_CONVERSIONS = [
+    ("USD", "IDR", "Dollar to Rupiah"),
+    ("EUR", "USD", "Euro to Dollar"),
+    ("USD", "SGD", "Dollar to Singapore Dollar"),
+    ("USD", "MYR", "Dollar to Malaysian Ringgit"),
+]
+
 def display_quick_conversion_buttons():
     """Display quick conversion buttons for popular currency pairs"""
     st.subheader("💡 Popular Conversions")
-    popular_conversions = [
-        ("USD", "IDR", "Dollar to Rupiah"),
-        ("EUR", "USD", "Euro to Dollar"),
-        ("USD", "SGD", "Dollar to Singapore Dollar"),
-        ("USD", "MYR", "Dollar to Malaysian Ringgit"),
-    ]
     
-    for base, target, label in popular_conversions:
+    for base, target, label in POPULAR_CONVERSIONS:
         col1, col2 = st.columns([3, 1])
         with col1:
             st.write(f"**{label}**")
@@ -804,57 +1849,87 @@ def convert_currency(amount, base_currency, target_currency):
         return
         
     with st.spinner("Getting latest exchange rates..."):
-        rate = get_exchange_rate(base_currency, target_currency)
+        cross_rates = get_cross_rates()
+        rate = cross_rates.rate(base_currency, target_currency) if cross_rates else None
         
         if rate:
             converted_amount = amount * rate
-            display_conversion_results(amount, base_currency, converted_amount, target_currency, rate)
+            display_conversion_results(amount, base_currency, converted_amount, target_currency, rate, cross_rates.as_of)
+        elif cross_rates:
+            st.error(f"No exchange rate available for {base_currency} to {target_currency}.")
         else:
             st.error("Unable to fetch exchange rate. Please try again later.")
 
-def get_exchange_rate(base_currency, target_currency):
-    """Get exchange rate from API with fallback (uses cached version)"""
-    return cached_get_exchange_rate(base_currency, target_currency)
-
-def get_exchange_rate_impl(base_currency, target_currency):
-    """Actual implementation of exchange rate fetching"""
+def get_cross_rates():
+    """Cross rates for every currency pair, or None if no rates were ever fetched"""
+    # One table shared by every session and pair, served stale while it refreshes
     try:
-        rate_limited_request()  # Add rate limiting
-        
-        # Try multiple free API endpoints
-        apis = [
-            f"https://api.exchangerate-api.com/v4/latest/{base_currency}",
-            f"https://open.er-api.com/v6/latest/{base_currency}",
-        ]
-        
-        for api_url in apis:
-            try:
-                response = requests.get(api_url, timeout=10)
-                if response.status_code == 200:
-                    data = response.json()
-                    rate = data['rates'].get(target_currency, None)
-                    if rate:
-                        return rate
-            except:
-                continue
-        
-        # Fallback rates
-        return get_fallback_exchange_rate(base_currency, target_currency)
-        
-    except Exception as e:
-        st.error(f"API Error: {str(e)}")
+        return rate_table_cache.get(FX_BASE, fetch_cross_rates)
+    except UpstreamError:
+        return get_fx_snapshot_store().latest(FX_BASE)  # Every provider failed recently
+
+def fetch_cross_rates():
+    """Download the base currency's rate table, triangulate every pair and save it as a snapshot"""
+    rates = fetch_base_rates(FX_BASE)
+    if not rates:
         return None
+    cross_rates = CrossRates(FX_BASE, rates)
+    get_fx_snapshot_store().save(cross_rates)
+    return cross_rates
 
-def get_fallback_exchange_rate(base_currency, target_currency):
-    """Provide fallback exchange rates if API fails"""
-    fallback_rates = {
-        'USD': {'IDR': 15500, 'EUR': 0.92, 'SGD': 1.35, 'MYR': 4.75, 'JPY': 150.50, 'GBP': 0.79, 'AUD': 1.52},
-        'EUR': {'USD': 1.09, 'IDR': 16900, 'SGD': 1.47, 'MYR': 5.18, 'JPY': 164.00, 'GBP': 0.86, 'AUD': 1.66},
-        'IDR': {'USD': 0.000064, 'EUR': 0.000059, 'SGD': 0.000087, 'MYR': 0.00031, 'JPY': 0.0097, 'GBP': 0.000051, 'AUD': 0.000098},
-    }
-    return fallback_rates.get(base_currency, {}).get(target_currency, 1.0)
+def fetch_base_rates(base_currency):
+    """Download the rate table for a base currency from whichever provider answers first"""
+    source = get_data_source()
+    
+    def fetch_from(provider):
+        data = call_upstream(source.host(provider), source.limiter(provider), source.rate_table, provider, base_currency)
+        return data['rates'] if data and data.get('rates') else None
+    
+    # Providers are asked in parallel, fastest first, so a slow one costs a short hedge delay, not its timeout
+    try:
+        return hedged_call(list(FX_PROVIDERS), fetch_from, fx_provider_stats, timeout=FX_TIMEOUT)
+    except UpstreamError:
+        return None
 
-def display_conversion_results(amount, base_currency, converted_amount, target_currency, rate):
+FX_TIMEOUT = 10  # seconds to wait for any provider, the same as a single request's timeout
+FX_STALE_AFTER = 2 * rate_table_cache.ttl  # older rates mean the providers haven't been answering
+
+def format_age(seconds):
+    """Human-readable age such as '5 minutes' or '2 days'"""
+    for unit, size in [("day", 86400), ("hour", 3600), ("minute", 60)]:
+        if seconds >= size:
+            count = int(seconds // size)
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+    return "less than a minute"
+
+def display_cross_rates():
+    """Display the rate between every pair of converter currencies"""
+    with st.expander("📊 Cross Rates"):
+        cross_rates = get_cross_rates()
+        if cross_rates is None:
+            st.info("No exchange rates have been fetched yet.")
+            return
+        st.dataframe(cross_rates.table(CONVERTER_CURRENCIES).style.format("{:,.4f}"), use_container_width=True)
+        st.caption(f"1 unit of the row currency in each column currency, all triangulated through {cross_rates.base}. "
+                   f"Updated {format_age(time.time() - cross_rates.as_of)} ago.")
+        display_fx_provider_stats()
+
+def display_fx_provider_stats():
+    """Display how fast and reliable each exchange-rate provider has been"""
+    stats = fx_provider_stats.status()
+    if not stats:
+        return
+    ranking = fx_provider_stats.ranked([row['provider'] for row in stats])
+    st.dataframe(pd.DataFrame([{
+        "Provider": row['provider'],
+        "Priority": ranking.index(row['provider']) + 1,
+        "Avg Latency (ms)": f"{row['latency'] * 1000:,.0f}" if row['latency'] is not None else "-",
+        "Error Rate": f"{row['error_rate'] * 100:.0f}%",
+        "Successes": row['successes'],
+        "Failures": row['failures'],
+    } for row in stats]).sort_values("Priority"), hide_index=True, use_container_width=True)
+
+def display_conversion_results(amount, base_currency, converted_amount, target_currency, rate, as_of):
     """Display currency conversion results"""
     st.success(f"**💱 Conversion Result:**")
     
@@ -884,6 +1959,13 @@ def display_conversion_results(amount, base_currency, converted_amount, target_c
         """, unsafe_allow_html=True)
     
     st.info(f"**Exchange Rate:** 1 {base_currency} = {rate:.4f} {target_currency}")
+    
+    age = time.time() - as_of
+    if age > FX_STALE_AFTER:
+        st.warning(f"⚠️ Exchange-rate providers aren't answering. Showing the last saved rates from "
+                   f"{datetime.fromtimestamp(as_of):%Y-%m-%d %H:%M} ({format_age(age)} old).")
+    else:
+        st.caption(f"Rates updated {format_age(age)} ago.")
 
 # =============================================================================
 # MORTGAGE CALCULATOR FUNCTIONS
@@ -1009,8 +2091,10 @@ def display_mortgage_breakdown(monthly_payment, params):
         ]
     }
     
-    fig_pie = px.pie(breakdown_data, values='Amount', names='Component', title="Monthly Payment Composition")
-    st.plotly_chart(fig_pie, use_container_width=True)
+    plot_cached_figure(
+        ('mortgage_breakdown',) + tuple(breakdown_data['Amount']),
+        lambda: px.pie(breakdown_data, values='Amount', names='Component', title="Monthly Payment Composition")
+    )
 
 def display_amortization_schedule(loan_amount, interest_rate, loan_term):
     """Calculate and display amortization schedule"""
@@ -1096,15 +2180,19 @@ def show_retirement_planner():
         inflation_rate = st.slider("Expected Inflation Rate (%)", 1.0, 5.0, 2.5, step=0.1)
         investment_return = st.slider("Expected Investment Return (%)", 1.0, 15.0, 7.0, step=0.5)
         life_expectancy = st.slider("Life Expectancy", 75, 100, 85)
+        simulations = st.select_slider("Monte Carlo Paths", options=MONTE_CARLO_PATH_OPTIONS, value=MONTE_CARLO_SIMULATIONS,
+                                       format_func=lambda n: f"{n:,}", key="retirement_simulations")
+    return_source = get_return_source_inputs("retirement")
     
     if st.button("🎯 Calculate Retirement Plan", type="primary"):
         calculate_retirement_plan(
             current_age, retirement_age, current_savings, annual_contribution,
-            desired_income, inflation_rate, investment_return, life_expectancy
+            desired_income, inflation_rate, investment_return, life_expectancy, simulations, return_source
         )
 
 def calculate_retirement_plan(current_age, retirement_age, current_savings, annual_contribution,
-                            desired_income, inflation_rate, investment_return, life_expectancy):
+                            desired_income, inflation_rate, investment_return, life_expectancy,
+                            simulations=MONTE_CARLO_SIMULATIONS, return_source=()):
     """Calculate and display retirement plan"""
     years_to_retirement = retirement_age - current_age
     retirement_years = life_expectancy - retirement_age
@@ -1121,14 +2209,18 @@ def calculate_retirement_plan(current_age, retirement_age, current_savings, annu
     
     # Display results
     display_retirement_results(future_savings, required_savings, years_to_retirement, retirement_years)
+    display_retirement_goal_seek(required_savings, current_savings, annual_contribution, investment_return,
+                                 years_to_retirement, retirement_age)
     display_retirement_savings_projection(current_savings, annual_contribution, investment_return, years_to_retirement)
+    if retirement_years > 0:
+        display_retirement_monte_carlo(
+            current_age, (current_savings, annual_contribution, years_to_retirement, retirement_years,
+                          desired_income, investment_return, inflation_rate, simulations), return_source
+        )
 
 def calculate_future_savings(current_savings, annual_contribution, return_rate, years):
     """Calculate future value of retirement savings"""
-    future_value = current_savings
-    for year in range(years):
-        future_value = future_value * (1 + return_rate/100) + annual_contribution
-    return future_value
+    return float(analytics.retirement_savings(current_savings, annual_contribution, return_rate, years))
 
 def calculate_required_retirement_savings(desired_income, inflation_rate, return_rate, retirement_years):
     """Calculate required retirement savings to support desired income"""
@@ -1167,10 +2259,35 @@ def display_retirement_results(future_savings, required_savings, years_to_retire
     else:
         st.error(f"**Needs attention.** Consider increasing your savings rate. Readiness score: {readiness_score:.1f}%")
 
+def display_retirement_goal_seek(required_savings, current_savings, annual_contribution, return_rate,
+                                 years_to_retirement, retirement_age):
+    """Show what single change would reach the required savings"""
+    st.subheader("🎯 What It Takes to Reach Your Goal")
+    goal = analytics.retirement_goal_seek(required_savings, current_savings, annual_contribution, return_rate, years_to_retirement)
+    contribution, rate, years = (float(goal[name]) for name in ('annual_contribution', 'return_rate', 'years'))
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Required Annual Contribution", f"${contribution:,.0f}", f"{contribution - annual_contribution:+,.0f} $",
+                  delta_color="inverse")
+    with col2:
+        st.metric("Required Return", f"{rate:.2f}%" if np.isfinite(rate) else "Not reachable",
+                  f"{rate - return_rate:+.2f}%" if np.isfinite(rate) else None, delta_color="inverse")
+    with col3:
+        st.metric("Retirement Age at Current Pace", f"{retirement_age - years_to_retirement + years:.1f}" if np.isfinite(years) else "Not reachable",
+                  f"{years - years_to_retirement:+.1f} years" if np.isfinite(years) else None, delta_color="inverse")
+    st.caption("Each figure changes only that one input and keeps the rest of your plan as entered.")
+
 def display_retirement_savings_projection(current_savings, annual_contribution, return_rate, years):
     """Display retirement savings projection chart"""
     st.subheader("📈 Retirement Savings Projection")
-    
+    plot_cached_figure(
+        ('retirement_projection', current_savings, annual_contribution, return_rate, years),
+        lambda: build_retirement_projection_chart(current_savings, annual_contribution, return_rate, years)
+    )
+
+def build_retirement_projection_chart(current_savings, annual_contribution, return_rate, years):
+    """Build retirement savings projection chart"""
     projection_data = []
     savings = current_savings
     
@@ -1183,8 +2300,45 @@ def display_retirement_savings_projection(current_savings, annual_contribution,
         savings = savings * (1 + return_rate/100) + annual_contribution
     
     df_projection = pd.DataFrame(projection_data)
-    fig = px.line(df_projection, x='Year', y='Savings', title='Retirement Savings Growth Over Time')
-    st.plotly_chart(fig, use_container_width=True)
+    return px.line(df_projection, x='Year', y='Savings', title='Retirement Savings Growth Over Time')
+
+@st.cache_data(ttl=3600, max_entries=32)  # Cache simulations for an hour
+def run_retirement_simulation(current_savings, annual_contribution, years_to_retirement, retirement_years,
+                              desired_income, return_rate, inflation_rate, simulations=MONTE_CARLO_SIMULATIONS,
+                              historical_returns=None, match_expected_return=True, seed=MONTE_CARLO_SEED):
+    """Run Monte Carlo simulation of saving for and drawing down retirement savings"""
+    volatility = max(return_rate * 0.3, 5)
+    return analytics.simulate_retirement(
+        current_savings, annual_contribution, years_to_retirement, retirement_years, desired_income,
+        return_rate, volatility, inflation_rate, simulations=simulations, seed=seed,
+        historical_returns=historical_returns, match_expected_return=match_expected_return
+    )
+
+def display_retirement_monte_carlo(current_age, simulation_inputs, return_source):
+    """Display the simulated range of retirement savings and the chance they last"""
+    st.subheader("🎯 Monte Carlo Simulation")
+    simulation = run_simulation(run_retirement_simulation, simulation_inputs, return_source)
+    if not simulation:
+        return
+    
+    def build_chart():
+        fig = build_monte_carlo_chart(simulation)
+        fig.update_traces(x=simulation['years'] + current_age)
+        fig.update_layout(title=f"Retirement Savings - {simulation['simulations']:,} Simulated Lifetimes{simulation['label']}",
+                          xaxis_title="Age")
+        return fig
+    
+    plot_cached_figure(('retirement_monte_carlo', current_age) + simulation_inputs + simulation['return_key'], build_chart)
+    
+    years_to_retirement = simulation_inputs[2]
+    bands = simulation['percentiles']
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Chance Savings Last", f"{simulation['success_rate']*100:.0f}%")
+    with col2:
+        st.metric("Median at Retirement", f"${bands[50][years_to_retirement]:,.0f}")
+    with col3:
+        st.metric("Median Left at the End", f"${bands[50][-1]:,.0f}")
 
 # =============================================================================
 # RUN THE APPLICATION